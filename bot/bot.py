@@ -1,9 +1,12 @@
 import os
 import logging
 import asyncio
+import contextlib
+import signal
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
-from bot.handlers import register_handlers
+from bot.handlers import register_handlers, setup_send_throttling
+from bot.db_storage import initialize as initialize_storage
 
 class BotApp:
     def __init__(self):
@@ -15,34 +18,99 @@ class BotApp:
             self.logger.error("TELEGRAM_BOT_TOKEN not found in environment variables")
             raise ValueError("TELEGRAM_BOT_TOKEN environment variable is required")
 
+        # Создаем схему БД и прогреваем кэш пользователей
+        initialize_storage()
+
         # Initialize bot and dispatcher
-        self.bot = Bot(token=self.bot_token)
-        self.storage = MemoryStorage()
+        self.bot = Bot(token=self.bot_token, session=self._create_session())
+        # Все исходящие send/edit проходят через токен-бакеты на уровне
+        # сессии — обработчикам не нужно просить слот вручную
+        setup_send_throttling(self.bot)
+        self.storage = self._create_storage()
         # In aiogram 3.x, Dispatcher doesn't take bot as a parameter
         self.dp = Dispatcher(storage=self.storage)
         
         # Register handlers
         register_handlers(self.dp)
-    
+
+    def _create_session(self):
+        """Сессия Bot API с orjson вместо stdlib json, если orjson доступен
+
+        Каждый апдейт и каждый ответ проходят через (де)сериализацию JSON;
+        orjson делает это в разы быстрее. None — aiogram создаст сессию
+        со стандартным json сам.
+        """
+        try:
+            import orjson
+            from aiogram.client.session.aiohttp import AiohttpSession
+        except ImportError:
+            return None
+        return AiohttpSession(
+            json_loads=orjson.loads,
+            json_dumps=lambda obj: orjson.dumps(obj).decode(),
+        )
+
+    def _create_storage(self):
+        """Выбрать хранилище FSM: Redis при заданном REDIS_URL, иначе память"""
+        redis_url = os.environ.get("REDIS_URL")
+        if redis_url:
+            try:
+                from aiogram.fsm.storage.redis import RedisStorage
+                self.logger.info("Using RedisStorage for FSM state")
+                return RedisStorage.from_url(redis_url)
+            except ImportError:
+                self.logger.warning(
+                    "REDIS_URL задан, но redis не установлен — используем MemoryStorage"
+                )
+        return MemoryStorage()
+
     async def main(self):
         """Main function to start the bot"""
         self.logger.info("Starting bot...")
         
         # Удаляем меню команд у бота
         await self.bot.delete_my_commands()
-        
-        # Start polling (aiogram 3.x way)
+
+        # Start polling (aiogram 3.x way). Запрашиваем только те типы
+        # апдейтов, на которые есть обработчики: Telegram не будет слать
+        # edited_message/chat_member и прочее, что бот все равно игнорирует
+        polling_task = asyncio.create_task(
+            self.dp.start_polling(self.bot, allowed_updates=["message", "callback_query"])
+        )
+
+        # Кооперативное завершение: по SIGTERM/SIGINT отменяем задачу
+        # поллинга вместо жесткого убийства процесса
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, polling_task.cancel)
+            except NotImplementedError:
+                # Например, Windows — остаётся стандартная обработка сигналов
+                pass
+
         try:
-            # In aiogram 3.x, polling is started differently
-            await self.dp.start_polling(self.bot)
+            await polling_task
+        except asyncio.CancelledError:
+            self.logger.info("Polling cancelled, shutting down...")
         except Exception as e:
             self.logger.error(f"Error starting bot: {e}")
         finally:
-            # In aiogram 3.x, session closing is handled automatically
+            # Явно закрываем aiohttp-сессию, чтобы не оставлять сокеты
+            with contextlib.suppress(Exception):
+                await self.bot.session.close()
             self.logger.info("Bot stopped")
 
-bot_app = BotApp()
+# Ленивый синглтон: приложение создается при первом обращении,
+# а не при импорте модуля (импорт bot.bot становится дешевым)
+_bot_app = None
+
+def get_bot_app() -> BotApp:
+    """Получить (или создать при первом вызове) экземпляр приложения бота"""
+    global _bot_app
+    if _bot_app is None:
+        _bot_app = BotApp()
+    return _bot_app
 
 if __name__ == "__main__":
     # Run bot if script is executed directly
-    asyncio.run(bot_app.main())
+    asyncio.run(get_bot_app().main())
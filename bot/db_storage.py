@@ -1,12 +1,18 @@
 import logging
 import os
-import pytz
-from datetime import datetime, date, tzinfo, timedelta
-from typing import Dict, List, Any, Optional
-
-from bot.models import User, FoodEntry, get_db, init_db
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime, date, time, timezone, tzinfo, timedelta
+from zoneinfo import ZoneInfo
+from functools import lru_cache
+from time import monotonic
+from types import MappingProxyType
+from typing import Dict, List, Any, Mapping, Optional, Tuple
+
+from bot.models import User, FoodEntry, init_db, session_scope
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import func, and_
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -35,6 +41,123 @@ AVAILABLE_TIMEZONES = {
     "KYIV": "Europe/Kyiv",        # Киев UTC+2
 }
 
+# Готовые строки прогресс-баров: 11 вариантов заполнения (0..10) на цвет.
+# Избавляет горячий путь рендера от конкатенации эмодзи на каждый вызов
+_BAR_WIDTH = 10
+_BAR_CACHE = {
+    color: tuple(color * i + "⬜" * (_BAR_WIDTH - i) for i in range(_BAR_WIDTH + 1))
+    for color in ("🟩", "🟨", "🟥")
+}
+
+# Стандартные дневные нормы нутриентов, если лимит не задан пользователем
+_DEFAULT_NUTRIENT_TARGETS = {
+    "protein": 75,      # 75г белка - стандартная рекомендация
+    "fat": 60,          # 60г жиров - стандартная рекомендация
+    "carbs": 250,       # 250г углеводов - стандартная рекомендация
+    "fiber": 25,        # 25г клетчатки - стандартная рекомендация
+    "sugar": 50,        # 50г сахара - верхний предел по рекомендациям ВОЗ
+    "sodium": 2300,     # 2300мг натрия - рекомендация ВОЗ
+    "cholesterol": 300, # 300мг холестерина - стандартная рекомендация
+}
+
+@lru_cache(maxsize=32)
+def format_date(target_date: date) -> str:
+    """Отформатировать дату как ДД.ММ.ГГГГ (strftime с кэшем по дате)"""
+    return target_date.strftime("%d.%m.%Y")
+
+@lru_cache(maxsize=64)
+def _get_tz(tz_name: str) -> tzinfo:
+    """Получить (и закэшировать) объект часового пояса по названию IANA"""
+    return ZoneInfo(tz_name)
+
+def _format_offset(offset: Optional[timedelta]) -> str:
+    """Отформатировать смещение UTC вида "UTC+3" / "UTC+5:30" """
+    if offset is None:
+        return "UTC+0"
+    total_minutes = int(offset.total_seconds() // 60)
+    if total_minutes == 0:
+        return "UTC+0"
+    sign = "+" if total_minutes >= 0 else "-"
+    hours, minutes = divmod(abs(total_minutes), 60)
+    if minutes == 0:
+        return f"UTC{sign}{hours}"
+    return f"UTC{sign}{hours}:{minutes:02d}"
+
+# Запись таблицы поясов: имя IANA, объект tzinfo и готовая строка
+# смещения (None для поясов с сезонным переводом часов)
+_TZEntry = namedtuple("_TZEntry", "name tz static_offset")
+
+def _build_tz_table() -> "Mapping[str, _TZEntry]":
+    """Собрать замороженную таблицу поясов со всем предвычисленным.
+
+    Пояс считается фиксированным, если его смещение совпадает в январе и
+    июле; для остальных (DST) строка смещения вычисляется при обращении.
+    """
+    year = datetime.now(timezone.utc).year
+    winter = datetime(year, 1, 15)
+    summer = datetime(year, 7, 15)
+    table = {}
+    for code, name in AVAILABLE_TIMEZONES.items():
+        tz = _get_tz(name)
+        static_offset = None
+        if tz.utcoffset(winter) == tz.utcoffset(summer):
+            static_offset = _format_offset(tz.utcoffset(winter))
+        table[code] = _TZEntry(name, tz, static_offset)
+    return MappingProxyType(table)
+
+_TZ_TABLE = _build_tz_table()
+
+# Время жизни кэша дневной статистики/записей: частые перерисовки меню
+# в пределах этого окна не порождают повторных запросов к БД
+_DAY_CACHE_TTL = 30  # секунд
+
+# Пары (ключ значения, префикс полей лимита/процента) для сборки статистики:
+# "calories" -> calorie_limit / calorie_percentage и т.д.
+_NUTRIENT_FIELDS = (
+    ("calories", "calorie"),
+    ("protein", "protein"),
+    ("fat", "fat"),
+    ("carbs", "carbs"),
+    ("fiber", "fiber"),
+    ("sugar", "sugar"),
+    ("sodium", "sodium"),
+    ("cholesterol", "cholesterol"),
+)
+
+# Колонки записи о приеме пищи в порядке, ожидаемом _entry_row_to_dict
+_ENTRY_COLUMNS = (
+    FoodEntry.id,
+    FoodEntry.food_name,
+    FoodEntry.calories,
+    FoodEntry.protein,
+    FoodEntry.fat,
+    FoodEntry.carbs,
+    FoodEntry.fiber,
+    FoodEntry.sugar,
+    FoodEntry.sodium,
+    FoodEntry.cholesterol,
+    FoodEntry.timestamp,
+)
+
+def _entry_row_to_dict(row) -> Dict[str, Any]:
+    """Преобразовать кортеж колонок записи в словарь для обработчиков"""
+    return {
+        "id": row[0],
+        "food_name": row[1],
+        "calories": row[2],
+        "protein": row[3],
+        "fat": row[4],
+        "carbs": row[5],
+        "fiber": row[6],
+        "sugar": row[7],
+        "sodium": row[8],
+        "cholesterol": row[9],
+        "timestamp": row[10].isoformat(),
+        # Готовая строка времени для карточки приема пищи:
+        # читателю не нужно парсить ISO-строку обратно
+        "time": row[10].strftime("%H:%M:%S")
+    }
+
 class DBUserData:
     """Класс для работы с данными пользователя в базе данных"""
 
@@ -49,53 +172,80 @@ class DBUserData:
         self.user_weight = None
         self.body_fat_percentage = None
         self.timezone_code = "МСК"
+        self._tz: Optional[tzinfo] = None  # Кэш объекта часового пояса
+        self._day_cache: Dict[Tuple[str, date], Tuple[int, Any]] = {}
         self.load_from_db()
 
+    @classmethod
+    def from_db_row(cls, user: "User") -> "DBUserData":
+        """Создать объект из уже загруженной строки users, не обращаясь к БД"""
+        data = cls.__new__(cls)
+        data.user_id = user.id
+        data.calorie_limit = user.calorie_limit
+        data.protein_limit = user.protein_limit
+        data.fat_limit = user.fat_limit
+        data.carbs_limit = user.carbs_limit
+        data.fiber_limit = user.fiber_limit
+        data.user_weight = user.user_weight
+        data.body_fat_percentage = user.body_fat_percentage
+        data.timezone_code = user.timezone_code
+        data._tz = None
+        data._day_cache = {}
+        return data
+
     def load_from_db(self):
         """Загрузить данные пользователя из базы"""
-        db = get_db()
         try:
-            user = db.query(User).filter(User.id == self.user_id).first()
-            if user:
-                self.calorie_limit = user.calorie_limit
-                self.protein_limit = user.protein_limit
-                self.fat_limit = user.fat_limit
-                self.carbs_limit = user.carbs_limit
-                self.fiber_limit = user.fiber_limit
-                self.user_weight = user.user_weight
-                self.body_fat_percentage = user.body_fat_percentage
-                self.timezone_code = user.timezone_code
-            else:
-                # Создаем нового пользователя
-                user = User(id=self.user_id, timezone_code=self.timezone_code)
-                db.add(user)
-                db.commit()
+            with session_scope() as db:
+                user = db.query(User).filter(User.id == self.user_id).first()
+                if user:
+                    self.calorie_limit = user.calorie_limit
+                    self.protein_limit = user.protein_limit
+                    self.fat_limit = user.fat_limit
+                    self.carbs_limit = user.carbs_limit
+                    self.fiber_limit = user.fiber_limit
+                    self.user_weight = user.user_weight
+                    self.body_fat_percentage = user.body_fat_percentage
+                    self.timezone_code = user.timezone_code
+                    # Первое сообщение почти всегда запрашивает статистику
+                    # за сегодня — греем её в той же сессии, чтобы не
+                    # открывать второе соединение сразу после первого
+                    today = self.get_current_date()
+                    self._day_cache_put("stats", today, self._fetch_day_stats(db, today))
+                else:
+                    # Создаем нового пользователя атомарно: при гонке двух
+                    # обработчиков ON CONFLICT не даст второму INSERT упасть
+                    db.execute(
+                        pg_insert(User)
+                        .values(id=self.user_id, timezone_code=self.timezone_code)
+                        .on_conflict_do_nothing(index_elements=[User.id])
+                    )
+                    today = self.get_current_date()
+                    self._day_cache_put(
+                        "stats", today,
+                        self._stats_payload(today, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+                    )
         except SQLAlchemyError as e:
             logger.error(f"Ошибка при загрузке пользователя из БД: {e}")
-            db.rollback()
-        finally:
-            db.close()
 
     @property
     def timezone(self) -> tzinfo:
         """Получить объект часового пояса пользователя"""
-        # Проверяем, есть ли код в словаре или используем Москву по умолчанию
-        try:
-            tz_name = AVAILABLE_TIMEZONES.get(self.timezone_code)
-            if not tz_name:
-                tz_name = "Europe/Moscow"
-                logger.warning(f"Неизвестный код часового пояса: {self.timezone_code}, используем Europe/Moscow")
-                # Исправляем код часового пояса на правильный
-                self.timezone_code = "МСК"
-                # Сохраняем исправленный код в базу
-                self.set_timezone("МСК")
-
-            # Возвращаем объект часового пояса
-            return pytz.timezone(tz_name)
-        except Exception as e:
-            logger.error(f"Ошибка при получении часового пояса: {e}")
-            # Если произошла ошибка, возвращаем часовой пояс Москвы
-            return pytz.timezone("Europe/Moscow")
+        # Сначала смотрим в кэш на экземпляре — он сбрасывается в set_timezone
+        if self._tz is not None:
+            return self._tz
+
+        entry = _TZ_TABLE.get(self.timezone_code)
+        if entry is None:
+            logger.warning(f"Неизвестный код часового пояса: {self.timezone_code}, используем Europe/Moscow")
+            # Исправляем код часового пояса на правильный и сохраняем в базу
+            self.set_timezone("МСК")
+            entry = _TZ_TABLE["МСК"]
+        tz = entry.tz
+
+        # Кэшируем и возвращаем объект часового пояса
+        self._tz = tz
+        return tz
 
     def get_current_datetime(self) -> datetime:
         """Получить текущее время в часовом поясе пользователя"""
@@ -109,64 +259,44 @@ class DBUserData:
 
     def set_timezone(self, timezone_code: str) -> bool:
         """Установить часовой пояс пользователя"""
-        if timezone_code not in AVAILABLE_TIMEZONES:
+        if timezone_code not in _TZ_TABLE:
             return False
 
         self.timezone_code = timezone_code
+        self._tz = None  # Сбрасываем кэш часового пояса
+        self._invalidate_day_cache()  # Границы суток зависят от пояса
 
-        db = get_db()
         try:
-            user = db.query(User).filter(User.id == self.user_id).first()
-            if user:
-                user.timezone_code = timezone_code
-                db.commit()
-                return True
-            return False
+            with session_scope() as db:
+                # Один UPDATE вместо SELECT строки и её мутации
+                updated = db.query(User).filter(User.id == self.user_id).update(
+                    {User.timezone_code: timezone_code},
+                    synchronize_session=False
+                )
+                return updated > 0
         except SQLAlchemyError as e:
             logger.error(f"Ошибка при установке часового пояса: {e}")
-            db.rollback()
             return False
-        finally:
-            db.close()
 
     def get_timezone_name(self) -> str:
         """Получить название часового пояса"""
-        # Проверяем, есть ли код в словаре или используем Москву по умолчанию
-        try:
-            tz_name = AVAILABLE_TIMEZONES.get(self.timezone_code)
-            if not tz_name:
-                tz_name = "Europe/Moscow"
-                logger.warning(f"Неизвестный код часового пояса при получении имени: {self.timezone_code}, используем Europe/Moscow")
-                # Исправляем код часового пояса на правильный
-                self.timezone_code = "МСК"
-                # Сохраняем исправленный код в базу
-                self.set_timezone("МСК")
-            return tz_name
-        except Exception as e:
-            logger.error(f"Ошибка при получении названия часового пояса: {e}")
-            return "Europe/Moscow"
+        entry = _TZ_TABLE.get(self.timezone_code)
+        if entry is None:
+            logger.warning(f"Неизвестный код часового пояса при получении имени: {self.timezone_code}, используем Europe/Moscow")
+            # Исправляем код часового пояса на правильный и сохраняем в базу
+            self.set_timezone("МСК")
+            entry = _TZ_TABLE["МСК"]
+        return entry.name
 
     def get_timezone_offset(self) -> str:
         """Получить смещение часового пояса относительно UTC"""
-        tz = self.timezone
-        now = datetime.utcnow()
-        offset = tz.utcoffset(now)
-        if offset is None:
-            return "UTC+0"
-        hours = offset.total_seconds() // 3600
-        minutes = (offset.total_seconds() % 3600) // 60
-
-        if hours == 0 and minutes == 0:
-            return "UTC+0"
-
-        sign = "+" if hours >= 0 else "-"
-        hours = abs(hours)
-        minutes = abs(minutes)
-
-        if minutes == 0:
-            return f"UTC{sign}{int(hours)}"
-        else:
-            return f"UTC{sign}{int(hours)}:{int(minutes):02d}"
+        entry = _TZ_TABLE.get(self.timezone_code)
+        # Для поясов без перевода часов строка посчитана при импорте
+        if entry is not None and entry.static_offset is not None:
+            return entry.static_offset
+
+        # Пояса с DST (или неизвестный код): смещение зависит от даты
+        return _format_offset(self.timezone.utcoffset(datetime.utcnow()))
 
     def add_food_entry(self, food_name: str, calories: float, protein: float, fat: float, carbs: float, 
                       fiber: float = 0, sugar: float = 0, sodium: float = 0, cholesterol: float = 0) -> Dict[str, Any]:
@@ -189,46 +319,136 @@ class DBUserData:
         """
         current_time = self.get_current_datetime()
 
-        db = get_db()
         try:
-            # Создаем новую запись о приеме пищи
-            entry = FoodEntry(
-                user_id=self.user_id,
-                food_name=food_name,
-                calories=calories,
-                protein=protein,
-                fat=fat,
-                carbs=carbs,
-                fiber=fiber,
-                sugar=sugar,
-                sodium=sodium,
-                cholesterol=cholesterol,
-                timestamp=current_time
-            )
+            with session_scope() as db:
+                entry = self._build_entry(food_name, calories, protein, fat, carbs,
+                                          fiber, sugar, sodium, cholesterol, current_time)
+                db.add(entry)
+                db.flush()  # Получаем id записи до коммита
+
+                self._invalidate_day_cache()
+                return entry.to_dict()
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при добавлении записи о еде: {e}")
+            return self._entry_fallback(food_name, calories, protein, fat, carbs,
+                                        fiber, sugar, sodium, cholesterol, current_time)
+
+    def add_food_entry_with_stats(self, food_name: str, calories: float, protein: float, fat: float,
+                                  carbs: float, fiber: float = 0, sugar: float = 0, sodium: float = 0,
+                                  cholesterol: float = 0) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Добавить запись о еде и вернуть её вместе со свежей сводкой за сегодня
+
+        Экран подтверждения показывает сводку сразу после вставки; INSERT
+        и агрегатный запрос выполняются одной сессией и одной транзакцией
+        вместо двух отдельных походов в БД.
 
-            db.add(entry)
-            db.commit()
-            db.refresh(entry)
+        Returns:
+            Пара (словарь созданной записи, статистика за сегодня)
+        """
+        current_time = self.get_current_datetime()
+        current_date = self.get_current_date()
 
-            return entry.to_dict()
+        try:
+            with session_scope() as db:
+                entry = self._build_entry(food_name, calories, protein, fat, carbs,
+                                          fiber, sugar, sodium, cholesterol, current_time)
+                db.add(entry)
+                db.flush()  # Агрегат ниже видит новую запись внутри транзакции
+
+                stats = self._fetch_day_stats(db, current_date)
+                entry_dict = entry.to_dict()
+
+            self._invalidate_day_cache()
+            self._day_cache_put("stats", current_date, stats)
+            return entry_dict, stats
         except SQLAlchemyError as e:
             logger.error(f"Ошибка при добавлении записи о еде: {e}")
-            db.rollback()
-            return {
-                "id": 0,
-                "food_name": food_name,
-                "calories": calories,
-                "protein": protein,
-                "fat": fat,
-                "carbs": carbs,
-                "fiber": fiber,
-                "sugar": sugar,
-                "sodium": sodium,
-                "cholesterol": cholesterol,
-                "timestamp": current_time.isoformat()
-            }
-        finally:
-            db.close()
+            fallback = self._entry_fallback(food_name, calories, protein, fat, carbs,
+                                            fiber, sugar, sodium, cholesterol, current_time)
+            return fallback, self._stats_payload(current_date, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+
+    def _build_entry(self, food_name: str, calories: float, protein: float, fat: float, carbs: float,
+                     fiber: float, sugar: float, sodium: float, cholesterol: float,
+                     current_time: datetime) -> FoodEntry:
+        """Собрать ORM-объект записи о приеме пищи"""
+        return FoodEntry(
+            user_id=self.user_id,
+            food_name=food_name,
+            calories=calories,
+            protein=protein,
+            fat=fat,
+            carbs=carbs,
+            fiber=fiber,
+            sugar=sugar,
+            sodium=sodium,
+            cholesterol=cholesterol,
+            timestamp=current_time
+        )
+
+    def _entry_fallback(self, food_name: str, calories: float, protein: float, fat: float, carbs: float,
+                        fiber: float, sugar: float, sodium: float, cholesterol: float,
+                        current_time: datetime) -> Dict[str, Any]:
+        """Словарь записи для ответа пользователю, когда запись в БД не удалась"""
+        return {
+            "id": 0,
+            "food_name": food_name,
+            "calories": calories,
+            "protein": protein,
+            "fat": fat,
+            "carbs": carbs,
+            "fiber": fiber,
+            "sugar": sugar,
+            "sodium": sodium,
+            "cholesterol": cholesterol,
+            "timestamp": current_time.isoformat()
+        }
+
+    def add_food_entries(self, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Добавить несколько записей о еде одной транзакцией
+
+        Вместо INSERT+COMMIT на каждую позицию все записи уходят одним
+        пакетом (insertmanyvalues) с одним коммитом.
+
+        Args:
+            entries: Список словарей с полями add_food_entry
+                     (food_name, calories, protein, fat, carbs и т.д.)
+
+        Returns:
+            Список словарей созданных записей
+        """
+        if not entries:
+            return []
+
+        current_time = self.get_current_datetime()
+
+        try:
+            with session_scope() as db:
+                rows = [
+                    FoodEntry(
+                        user_id=self.user_id,
+                        food_name=e["food_name"],
+                        calories=e.get("calories", 0),
+                        protein=e.get("protein", 0),
+                        fat=e.get("fat", 0),
+                        carbs=e.get("carbs", 0),
+                        fiber=e.get("fiber", 0),
+                        sugar=e.get("sugar", 0),
+                        sodium=e.get("sodium", 0),
+                        cholesterol=e.get("cholesterol", 0),
+                        timestamp=current_time
+                    )
+                    for e in entries
+                ]
+                db.add_all(rows)
+                db.flush()  # Один пакетный INSERT, id заполнены
+
+                self._invalidate_day_cache()
+                return [row.to_dict() for row in rows]
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при пакетном добавлении записей о еде: {e}")
+            return []
 
     def update_food_entry(self, entry_id: int, fiber: float = None, sugar: float = None, 
                           sodium: float = None, cholesterol: float = None) -> bool:
@@ -245,35 +465,36 @@ class DBUserData:
         Returns:
             bool: Успешно ли обновлена запись
         """
-        db = get_db()
+        # Обновляем только переданные параметры
+        updates = {
+            column: value
+            for column, value in (
+                (FoodEntry.fiber, fiber),
+                (FoodEntry.sugar, sugar),
+                (FoodEntry.sodium, sodium),
+                (FoodEntry.cholesterol, cholesterol),
+            )
+            if value is not None
+        }
+        if not updates:
+            return False
+
         try:
-            # Находим запись
-            entry = db.query(FoodEntry).filter(
-                FoodEntry.id == entry_id,
-                FoodEntry.user_id == self.user_id
-            ).first()
+            with session_scope() as db:
+                # Один UPDATE ... WHERE вместо SELECT записи и её мутации
+                updated = db.query(FoodEntry).filter(
+                    FoodEntry.id == entry_id,
+                    FoodEntry.user_id == self.user_id
+                ).update(updates, synchronize_session=False)
 
-            if not entry:
-                return False
+                if not updated:
+                    return False
 
-            # Обновляем только переданные параметры
-            if fiber is not None:
-                entry.fiber = fiber
-            if sugar is not None:
-                entry.sugar = sugar
-            if sodium is not None:
-                entry.sodium = sodium
-            if cholesterol is not None:
-                entry.cholesterol = cholesterol
-
-            db.commit()
-            return True
+                self._invalidate_day_cache()
+                return True
         except SQLAlchemyError as e:
             logger.error(f"Ошибка при обновлении записи о еде: {e}")
-            db.rollback()
             return False
-        finally:
-            db.close()
 
     def set_calorie_limit(self, limit: int) -> None:
         """Установить дневной лимит калорий"""
@@ -281,22 +502,20 @@ class DBUserData:
             return
 
         self.calorie_limit = limit
+        self._invalidate_day_cache()  # В статистике лежат проценты от лимита
 
-        db = get_db()
         try:
-            user = db.query(User).filter(User.id == self.user_id).first()
-            if user:
-                user.calorie_limit = limit
-                db.commit()
+            with session_scope() as db:
+                db.query(User).filter(User.id == self.user_id).update(
+                    {User.calorie_limit: limit},
+                    synchronize_session=False
+                )
         except SQLAlchemyError as e:
             logger.error(f"Ошибка при установке лимита калорий: {e}")
-            db.rollback()
-        finally:
-            db.close()
 
     def set_macros_limits(self, protein: float, fat: float, carbs: float, fiber: Optional[float] = None, 
                        sugar: Optional[float] = None, sodium: Optional[float] = None, 
-                       cholesterol: Optional[float] = None) -> bool:
+                       cholesterol: Optional[float] = None, db=None) -> bool:
         """
         Установить дневные лимиты макронутриентов
 
@@ -308,6 +527,8 @@ class DBUserData:
             sugar: Лимит сахара (г)
             sodium: Лимит натрия (мг)
             cholesterol: Лимит холестерина (мг)
+            db: Открытая сессия БД; если передана, запись идет в её транзакции
+                и коммит выполняет вызывающая сторона
 
         Returns:
             bool: Успешно ли установлены лимиты
@@ -333,35 +554,38 @@ class DBUserData:
         # Рассчитываем калории на основе КБЖУ
         calories = protein * 4 + fat * 9 + carbs * 4
         self.calorie_limit = int(calories)
+        self._invalidate_day_cache()  # В статистике лежат проценты от лимитов
 
-        db = get_db()
-        try:
+        def _write(db) -> bool:
             user = db.query(User).filter(User.id == self.user_id).first()
-            if user:
-                user.protein_limit = protein
-                user.fat_limit = fat
-                user.carbs_limit = carbs
-                user.calorie_limit = int(calories)
-
-                # Обновляем дополнительные лимиты в базе данных
-                if fiber is not None and fiber > 0:
-                    user.fiber_limit = fiber
-                if sugar is not None and sugar > 0:
-                    user.sugar_limit = sugar
-                if sodium is not None and sodium > 0:
-                    user.sodium_limit = sodium
-                if cholesterol is not None and cholesterol > 0:
-                    user.cholesterol_limit = cholesterol
-
-                db.commit()
-                return True
-            return False
+            if not user:
+                return False
+            user.protein_limit = protein
+            user.fat_limit = fat
+            user.carbs_limit = carbs
+            user.calorie_limit = int(calories)
+
+            # Обновляем дополнительные лимиты в базе данных
+            if fiber is not None and fiber > 0:
+                user.fiber_limit = fiber
+            if sugar is not None and sugar > 0:
+                user.sugar_limit = sugar
+            if sodium is not None and sodium > 0:
+                user.sodium_limit = sodium
+            if cholesterol is not None and cholesterol > 0:
+                user.cholesterol_limit = cholesterol
+            return True
+
+        # Внутри чужой транзакции — просто пишем, коммит снаружи
+        if db is not None:
+            return _write(db)
+
+        try:
+            with session_scope() as db:
+                return _write(db)
         except SQLAlchemyError as e:
             logger.error(f"Ошибка при установке лимита макронутриентов: {e}")
-            db.rollback()
             return False
-        finally:
-            db.close()
 
     def set_user_body_metrics(self, weight: float, body_fat: float) -> bool:
         """
@@ -394,194 +618,162 @@ class DBUserData:
         sodium = round(weight * 20, 1)  # 20мг натрия на кг веса
         cholesterol = round(weight * 3, 1)  # 3мг холестерина на кг веса
 
-        # Устанавливаем рассчитанные лимиты
-        self.set_macros_limits(
-            protein=protein, 
-            fat=fat, 
-            carbs=carbs, 
-            fiber=fiber,
-            sugar=sugar,
-            sodium=sodium,
-            cholesterol=cholesterol
-        )
-
-        db = get_db()
+        # Метрики тела и рассчитанные лимиты пишем одной транзакцией,
+        # а не тремя отдельными сессиями с коммитом в каждой
         try:
-            user = db.query(User).filter(User.id == self.user_id).first()
-            if user:
+            with session_scope() as db:
+                user = db.query(User).filter(User.id == self.user_id).first()
+                if not user:
+                    return False
                 user.user_weight = weight
                 user.body_fat_percentage = body_fat
-                db.commit()
-                return True
-            return False
+
+                # Устанавливаем рассчитанные лимиты в той же транзакции
+                return self.set_macros_limits(
+                    protein=protein,
+                    fat=fat,
+                    carbs=carbs,
+                    fiber=fiber,
+                    sugar=sugar,
+                    sodium=sodium,
+                    cholesterol=cholesterol,
+                    db=db
+                )
         except SQLAlchemyError as e:
             logger.error(f"Ошибка при установке метрик тела: {e}")
-            db.rollback()
             return False
-        finally:
-            db.close()
 
-    def get_stats_by_date(self, target_date: date) -> Dict[str, Any]:
-        """Получить статистику питания за конкретную дату"""
+    def _day_bounds_utc(self, target_date: date) -> Tuple[datetime, datetime]:
+        """
+        Границы суток пользователя в UTC: [местная полночь; полночь следующего дня)
+
+        Локализуем полночь один раз и получаем обе границы одной операцией
+        вместо двух astimezone-конвертаций на каждый запрос.
+        """
+        tz = self.timezone
         try:
-            # Более безопасный метод создания даты с часовым поясом
-            tz = self.timezone
-            # Создаем осведомленный о часовом поясе datetime в полночь целевой даты
-            target_start = datetime(
-                year=target_date.year,
-                month=target_date.month,
-                day=target_date.day,
-                hour=0, minute=0, second=0, microsecond=0,
-                tzinfo=pytz.UTC
-            ).astimezone(tz)
+            start_local = datetime.combine(target_date, time.min, tzinfo=tz)
         except Exception as e:
             logger.error(f"Ошибка при создании даты с часовым поясом: {e}")
-            # Создаем дату в UTC если произошла ошибка
-            target_start = datetime(
-                year=target_date.year,
-                month=target_date.month,
-                day=target_date.day,
-                hour=0, minute=0, second=0, microsecond=0,
-                tzinfo=pytz.UTC
-            )
+            # Если произошла ошибка, считаем сутки по UTC
+            start_local = datetime.combine(target_date, time.min, tzinfo=timezone.utc)
+        start_utc = start_local.astimezone(timezone.utc)
+        return start_utc, start_utc + timedelta(days=1)
+
+    def _day_cache_get(self, kind: str, target_date: date) -> Optional[Any]:
+        """Достать значение из кэша дня, если оно еще в окне TTL"""
+        cached = self._day_cache.get((kind, target_date))
+        if cached is not None and cached[0] == int(monotonic() // _DAY_CACHE_TTL):
+            return cached[1]
+        return None
+
+    def _day_cache_put(self, kind: str, target_date: date, value: Any) -> None:
+        """Положить значение в кэш дня с текущей TTL-меткой"""
+        self._day_cache[(kind, target_date)] = (int(monotonic() // _DAY_CACHE_TTL), value)
+
+    def _invalidate_day_cache(self) -> None:
+        """Сбросить кэш дня после любого изменения записей или лимитов"""
+        self._day_cache.clear()
+
+    def _stats_payload(self, target_date: date, entries: int, calories: float, protein: float,
+                       fat: float, carbs: float, fiber: float, sugar: float,
+                       sodium: float, cholesterol: float) -> Dict[str, Any]:
+        """Собрать словарь статистики с лимитами и процентами из готовых сумм"""
+        values = {
+            "calories": calories,
+            "protein": protein,
+            "fat": fat,
+            "carbs": carbs,
+            "fiber": fiber,
+            "sugar": sugar,
+            "sodium": sodium,
+            "cholesterol": cholesterol,
+        }
+
+        payload: Dict[str, Any] = {
+            "date": format_date(target_date),
+            "entries": entries,
+        }
+
+        # Один цикл вместо восьми одинаковых блоков if/round на нутриент
+        for value_key, prefix in _NUTRIENT_FIELDS:
+            value = values[value_key]
+            limit = getattr(self, f"{prefix}_limit", None)
+            percentage = 0
+            if limit and limit > 0:
+                percentage = min(100, (value / limit) * 100)
+            payload[value_key] = round(value, 1)
+            payload[f"{prefix}_limit"] = limit
+            payload[f"{prefix}_percentage"] = round(percentage, 1)
+
+        return payload
+
+    def get_day(self, target_date: date) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Получить статистику и приемы пищи за дату одним обращением к БД
 
-        target_end = target_start + timedelta(days=1, seconds=-1)
+        Записи выбираются один раз, агрегаты считаются по ним за один проход
+        в Python — вдвое меньше запросов, чем при раздельных вызовах
+        get_stats_by_date + get_entries_by_date.
 
-        # Конвертируем в UTC для SQL-запроса
-        target_start_utc = target_start.astimezone(pytz.UTC)
-        target_end_utc = target_end.astimezone(pytz.UTC)
+        Returns:
+            Кортеж (статистика, список записей)
+        """
+        entries = self.get_entries_by_date(target_date)
+
+        calories = protein = fat = carbs = fiber = sugar = sodium = cholesterol = 0
+        for entry in entries:
+            calories += entry["calories"] or 0
+            protein += entry["protein"] or 0
+            fat += entry["fat"] or 0
+            carbs += entry["carbs"] or 0
+            fiber += entry.get("fiber") or 0
+            sugar += entry.get("sugar") or 0
+            sodium += entry.get("sodium") or 0
+            cholesterol += entry.get("cholesterol") or 0
+
+        stats = self._stats_payload(target_date, len(entries), calories, protein, fat,
+                                    carbs, fiber, sugar, sodium, cholesterol)
+        return stats, entries
+
+    def _fetch_day_stats(self, db, target_date: date) -> Dict[str, Any]:
+        """Выполнить агрегатный запрос за день в переданной сессии"""
+        target_start_utc, target_end_utc = self._day_bounds_utc(target_date)
+
+        # Получаем суммарные показатели за день
+        stats = db.query(
+            func.count(FoodEntry.id).label("entries"),
+            func.sum(FoodEntry.calories).label("calories"),
+            func.sum(FoodEntry.protein).label("protein"),
+            func.sum(FoodEntry.fat).label("fat"),
+            func.sum(FoodEntry.carbs).label("carbs"),
+            func.sum(FoodEntry.fiber).label("fiber"),
+            func.sum(FoodEntry.sugar).label("sugar"),
+            func.sum(FoodEntry.sodium).label("sodium"),
+            func.sum(FoodEntry.cholesterol).label("cholesterol")
+        ).filter(
+            FoodEntry.user_id == self.user_id,
+            FoodEntry.timestamp >= target_start_utc,
+            FoodEntry.timestamp < target_end_utc
+        ).first()
+
+        return self._stats_payload(target_date, *(value or 0 for value in stats))
+
+    def get_stats_by_date(self, target_date: date) -> Dict[str, Any]:
+        """Получить статистику питания за конкретную дату"""
+        cached = self._day_cache_get("stats", target_date)
+        if cached is not None:
+            return cached
 
-        db = get_db()
         try:
-            # Получаем суммарные показатели за день
-            stats = db.query(
-                func.count(FoodEntry.id).label("entries"),
-                func.sum(FoodEntry.calories).label("calories"),
-                func.sum(FoodEntry.protein).label("protein"),
-                func.sum(FoodEntry.fat).label("fat"),
-                func.sum(FoodEntry.carbs).label("carbs"),
-                func.sum(FoodEntry.fiber).label("fiber"),
-                func.sum(FoodEntry.sugar).label("sugar"),
-                func.sum(FoodEntry.sodium).label("sodium"),
-                func.sum(FoodEntry.cholesterol).label("cholesterol")
-            ).filter(
-                FoodEntry.user_id == self.user_id,
-                FoodEntry.timestamp >= target_start_utc,
-                FoodEntry.timestamp <= target_end_utc
-            ).first()
-
-            entries = stats[0] or 0
-            calories = stats[1] or 0
-            protein = stats[2] or 0
-            fat = stats[3] or 0
-            carbs = stats[4] or 0
-            fiber = stats[5] or 0
-            sugar = stats[6] or 0
-            sodium = stats[7] or 0
-            cholesterol = stats[8] or 0
-
-            # Вычисляем проценты от лимитов
-            calorie_percentage = 0
-            if self.calorie_limit and self.calorie_limit > 0:
-                calorie_percentage = min(100, (calories / self.calorie_limit) * 100)
-
-            protein_percentage = 0
-            if self.protein_limit and self.protein_limit > 0:
-                protein_percentage = min(100, (protein / self.protein_limit) * 100)
-
-            fat_percentage = 0
-            if self.fat_limit and self.fat_limit > 0:
-                fat_percentage = min(100, (fat / self.fat_limit) * 100)
-
-            carbs_percentage = 0
-            if self.carbs_limit and self.carbs_limit > 0:
-                carbs_percentage = min(100, (carbs / self.carbs_limit) * 100)
-
-            fiber_percentage = 0
-            if self.fiber_limit and self.fiber_limit > 0:
-                fiber_percentage = min(100, (fiber / self.fiber_limit) * 100)
-                
-            # Рассчитываем проценты для дополнительных нутриентов
-            sugar_percentage = 0
-            if hasattr(self, 'sugar_limit') and self.sugar_limit and self.sugar_limit > 0:
-                sugar_percentage = min(100, (sugar / self.sugar_limit) * 100)
-                
-            sodium_percentage = 0
-            if hasattr(self, 'sodium_limit') and self.sodium_limit and self.sodium_limit > 0:
-                sodium_percentage = min(100, (sodium / self.sodium_limit) * 100)
-                
-            cholesterol_percentage = 0
-            if hasattr(self, 'cholesterol_limit') and self.cholesterol_limit and self.cholesterol_limit > 0:
-                cholesterol_percentage = min(100, (cholesterol / self.cholesterol_limit) * 100)
-
-            return {
-                "date": target_date.strftime("%d.%m.%Y"),
-                "entries": entries,
-                "calories": round(calories, 1),
-                "protein": round(protein, 1),
-                "fat": round(fat, 1),
-                "carbs": round(carbs, 1),
-                "fiber": round(fiber, 1),
-                "sugar": round(sugar, 1),
-                "sodium": round(sodium, 1),
-                "cholesterol": round(cholesterol, 1),
-
-                # Лимиты
-                "calorie_limit": self.calorie_limit,
-                "protein_limit": self.protein_limit,
-                "fat_limit": self.fat_limit,
-                "carbs_limit": self.carbs_limit,
-                "fiber_limit": self.fiber_limit,
-                "sugar_limit": getattr(self, 'sugar_limit', None),
-                "sodium_limit": getattr(self, 'sodium_limit', None),
-                "cholesterol_limit": getattr(self, 'cholesterol_limit', None),
-
-                # Проценты выполнения
-                "calorie_percentage": round(calorie_percentage, 1),
-                "protein_percentage": round(protein_percentage, 1),
-                "fat_percentage": round(fat_percentage, 1),
-                "carbs_percentage": round(carbs_percentage, 1),
-                "fiber_percentage": round(fiber_percentage, 1),
-                "sugar_percentage": round(sugar_percentage, 1),
-                "sodium_percentage": round(sodium_percentage, 1),
-                "cholesterol_percentage": round(cholesterol_percentage, 1)
-            }
+            with session_scope() as db:
+                payload = self._fetch_day_stats(db, target_date)
+
+            self._day_cache_put("stats", target_date, payload)
+            return payload
         except SQLAlchemyError as e:
             logger.error(f"Ошибка при получении статистики: {e}")
-            return {
-                "date": target_date.strftime("%d.%m.%Y"),
-                "entries": 0,
-                "calories": 0,
-                "protein": 0,
-                "fat": 0,
-                "carbs": 0,
-                "fiber": 0,
-                "sugar": 0,
-                "sodium": 0,
-                "cholesterol": 0,
-
-                # Лимиты
-                "calorie_limit": self.calorie_limit,
-                "protein_limit": self.protein_limit,
-                "fat_limit": self.fat_limit,
-                "carbs_limit": self.carbs_limit,
-                "fiber_limit": self.fiber_limit,
-                "sugar_limit": getattr(self, 'sugar_limit', None),
-                "sodium_limit": getattr(self, 'sodium_limit', None),
-                "cholesterol_limit": getattr(self, 'cholesterol_limit', None),
-
-                # Проценты выполнения
-                "calorie_percentage": 0,
-                "protein_percentage": 0,
-                "fat_percentage": 0,
-                "carbs_percentage": 0,
-                "fiber_percentage": 0,
-                "sugar_percentage": 0,
-                "sodium_percentage": 0,
-                "cholesterol_percentage": 0
-            }
-        finally:
-            db.close()
+            return self._stats_payload(target_date, 0, 0, 0, 0, 0, 0, 0, 0, 0)
 
     def get_today_stats(self) -> Dict[str, Any]:
         """Получить статистику питания за сегодня"""
@@ -590,48 +782,75 @@ class DBUserData:
 
     def get_entries_by_date(self, target_date: date) -> List[Dict[str, Any]]:
         """Получить приемы пищи за конкретную дату"""
-        try:
-            # Более безопасный метод создания даты с часовым поясом
-            tz = self.timezone
-            # Создаем осведомленный о часовом поясе datetime в полночь целевой даты
-            target_start = datetime(
-                year=target_date.year,
-                month=target_date.month,
-                day=target_date.day,
-                hour=0, minute=0, second=0, microsecond=0,
-                tzinfo=pytz.UTC
-            ).astimezone(tz)
-        except Exception as e:
-            logger.error(f"Ошибка при создании даты с часовым поясом: {e}")
-            # Создаем дату в UTC если произошла ошибка
-            target_start = datetime(
-                year=target_date.year,
-                month=target_date.month,
-                day=target_date.day,
-                hour=0, minute=0, second=0, microsecond=0,
-                tzinfo=pytz.UTC
-            )
+        cached = self._day_cache_get("entries", target_date)
+        if cached is not None:
+            return cached
 
-        target_end = target_start + timedelta(days=1, seconds=-1)
+        # Границы суток пользователя в UTC для SQL-запроса
+        target_start_utc, target_end_utc = self._day_bounds_utc(target_date)
 
-        # Конвертируем в UTC для SQL-запроса
-        target_start_utc = target_start.astimezone(pytz.UTC)
-        target_end_utc = target_end.astimezone(pytz.UTC)
-
-        db = get_db()
         try:
-            entries = db.query(FoodEntry).filter(
-                FoodEntry.user_id == self.user_id,
-                FoodEntry.timestamp >= target_start_utc,
-                FoodEntry.timestamp <= target_end_utc
-            ).order_by(FoodEntry.timestamp.desc()).all()
-
-            return [entry.to_dict() for entry in entries]
+            with session_scope() as db:
+                # Выбираем только нужные колонки: кортежи Row вместо полной
+                # ORM-гидратации объектов FoodEntry ради одного to_dict()
+                rows = db.query(*_ENTRY_COLUMNS).filter(
+                    FoodEntry.user_id == self.user_id,
+                    FoodEntry.timestamp >= target_start_utc,
+                    FoodEntry.timestamp < target_end_utc
+                ).order_by(FoodEntry.timestamp.desc()).all()
+
+                result = [_entry_row_to_dict(row) for row in rows]
+                self._day_cache_put("entries", target_date, result)
+                return result
         except SQLAlchemyError as e:
             logger.error(f"Ошибка при получении записей о еде: {e}")
             return []
-        finally:
-            db.close()
+
+    def get_entries_page(self, target_date: date, page: int, page_size: int = 5) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Получить одну страницу приемов пищи за дату и общее число записей
+
+        Пагинация выполняется в SQL (LIMIT/OFFSET плюс COUNT(*) OVER()),
+        поэтому в Python попадают только показываемые записи, а не весь
+        день целиком.
+
+        Returns:
+            Пара (записи страницы в порядке "новые сверху", всего записей за день)
+        """
+        cache_kind = f"entries_page:{page}:{page_size}"
+        cached = self._day_cache_get(cache_kind, target_date)
+        if cached is not None:
+            return cached
+
+        target_start_utc, target_end_utc = self._day_bounds_utc(target_date)
+        day_filter = (
+            FoodEntry.user_id == self.user_id,
+            FoodEntry.timestamp >= target_start_utc,
+            FoodEntry.timestamp < target_end_utc
+        )
+
+        try:
+            with session_scope() as db:
+                rows = db.query(
+                    *_ENTRY_COLUMNS,
+                    func.count(FoodEntry.id).over().label("total")
+                ).filter(*day_filter).order_by(
+                    FoodEntry.timestamp.desc()
+                ).offset(page * page_size).limit(page_size).all()
+
+                if rows:
+                    total = rows[0][11]
+                else:
+                    # Страница за пределами данных: окно не вернуло строк,
+                    # общее число берем отдельным COUNT
+                    total = db.query(func.count(FoodEntry.id)).filter(*day_filter).scalar() or 0
+
+            result = ([_entry_row_to_dict(row) for row in rows], total)
+            self._day_cache_put(cache_kind, target_date, result)
+            return result
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при получении страницы записей о еде: {e}")
+            return [], 0
 
     def get_today_entries(self) -> List[Dict[str, Any]]:
         """Получить приемы пищи за сегодня"""
@@ -640,48 +859,133 @@ class DBUserData:
 
     def delete_entry(self, entry_id: int) -> bool:
         """Удалить запись о приеме пищи по ID"""
-        db = get_db()
         try:
-            entry = db.query(FoodEntry).filter(
-                FoodEntry.id == entry_id, 
-                FoodEntry.user_id == self.user_id
-            ).first()
-
-            if entry:
-                db.delete(entry)
-                db.commit()
-                return True
-            return False
+            with session_scope() as db:
+                # Один DELETE с фильтром вместо SELECT записи и её удаления
+                deleted = db.query(FoodEntry).filter(
+                    FoodEntry.id == entry_id,
+                    FoodEntry.user_id == self.user_id
+                ).delete()
+                if deleted:
+                    self._invalidate_day_cache()
+                return deleted > 0
         except SQLAlchemyError as e:
             logger.error(f"Ошибка при удалении записи о еде: {e}")
-            db.rollback()
             return False
-        finally:
-            db.close()
 
     def delete_entry_by_index(self, index: int) -> bool:
         """Удалить запись о приеме пищи по индексу из текущих записей"""
-        # Получаем записи за сегодня
-        current_date = self.get_current_date()
-        entries = self.get_entries_by_date(current_date)
-
-        # Проверяем корректность индекса
-        if index < 0 or index >= len(entries):
+        if index < 0:
             return False
 
-        # Получаем ID записи для удаления
-        entry_id = entries[index]["id"]
-        return self.delete_entry(entry_id)
+        # Находим ID записи по смещению в том же порядке, в каком записи
+        # показываются пользователю (новые сверху), не вытягивая весь день
+        target_start_utc, target_end_utc = self._day_bounds_utc(self.get_current_date())
+
+        try:
+            with session_scope() as db:
+                entry_id = db.query(FoodEntry.id).filter(
+                    FoodEntry.user_id == self.user_id,
+                    FoodEntry.timestamp >= target_start_utc,
+                    FoodEntry.timestamp < target_end_utc
+                ).order_by(FoodEntry.timestamp.desc()).offset(index).limit(1).scalar()
+
+                if entry_id is None:
+                    return False
+
+                db.query(FoodEntry).filter(FoodEntry.id == entry_id).delete()
+                self._invalidate_day_cache()
+                return True
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при удалении записи о еде по индексу: {e}")
+            return False
 
     def get_last_week_dates(self) -> List[date]:
         """Получить список дат за последнюю неделю, включая сегодня"""
         today = self.get_current_date()
         return [today - timedelta(days=i) for i in range(7)]
 
+    def get_last_week_stats(self) -> Dict[date, Dict[str, Any]]:
+        """
+        Получить статистику за последние 7 дней одним сгруппированным запросом
+
+        Returns:
+            Словарь {дата: статистика за дату}
+        """
+        return self.get_stats_range(self.get_last_week_dates())
+
+    def get_stats_range(self, dates: List[date]) -> Dict[date, Dict[str, Any]]:
+        """
+        Получить статистику за набор подряд идущих дат одним запросом
+
+        Вместо отдельного вызова get_stats_by_date на каждую дату
+        выполняется один SELECT с GROUP BY по местной дате записи; дни
+        без записей заполняются нулями. Каждая дата попадает в кэш дня,
+        так что последующее листание истории не ходит в БД.
+
+        Args:
+            dates: Даты по убыванию (как в get_last_week_dates)
+
+        Returns:
+            Словарь {дата: статистика за дату}
+        """
+        week_dates = dates
+        start_utc, _ = self._day_bounds_utc(week_dates[-1])
+        _, end_utc = self._day_bounds_utc(week_dates[0])
+
+        # Местная дата записи для группировки по суткам пользователя.
+        # timestamp хранится как naive UTC, поэтому сначала помечаем его
+        # как UTC (timezone('UTC', ts) -> timestamptz) и только затем
+        # переводим в пояс пользователя; одинарный timezone() истолковал бы
+        # naive-значение как местное время и сдвинул дату в обратную сторону
+        day_local = func.date(
+            func.timezone(self.get_timezone_name(), func.timezone("UTC", FoodEntry.timestamp))
+        ).label("day")
+
+        totals: Dict[date, tuple] = {}
+        try:
+            with session_scope() as db:
+                rows = db.query(
+                    day_local,
+                    func.count(FoodEntry.id),
+                    func.sum(FoodEntry.calories),
+                    func.sum(FoodEntry.protein),
+                    func.sum(FoodEntry.fat),
+                    func.sum(FoodEntry.carbs),
+                    func.sum(FoodEntry.fiber),
+                    func.sum(FoodEntry.sugar),
+                    func.sum(FoodEntry.sodium),
+                    func.sum(FoodEntry.cholesterol)
+                ).filter(
+                    FoodEntry.user_id == self.user_id,
+                    FoodEntry.timestamp >= start_utc,
+                    FoodEntry.timestamp < end_utc
+                ).group_by(day_local).all()
+
+            for row in rows:
+                day = row[0]
+                if not isinstance(day, date):
+                    day = datetime.strptime(str(day), "%Y-%m-%d").date()
+                totals[day] = row[1:]
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при получении статистики за неделю: {e}")
+
+        stats_by_date = {}
+        for target_date in week_dates:
+            row = totals.get(target_date)
+            if row:
+                stats_by_date[target_date] = self._stats_payload(
+                    target_date, *[value or 0 for value in row])
+            else:
+                stats_by_date[target_date] = self._stats_payload(
+                    target_date, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+            # Прогреваем кэш дня: листание истории обслуживается без БД
+            self._day_cache_put("stats", target_date, stats_by_date[target_date])
+        return stats_by_date
+
     def generate_calorie_progress_bar(self, percentage: float, width: int = 10) -> str:
         """Создать текстовый прогресс-бар для потребления калорий"""
         filled_chars = min(int(percentage / 100 * width), width)
-        empty_chars = width - filled_chars
 
         if percentage < 85:
             bar_char = "🟩"  # Зеленый для нормального употребления
@@ -690,7 +994,10 @@ class DBUserData:
         else:
             bar_char = "🟥"  # Красный для превышения лимита
 
-        return f"{bar_char * filled_chars}{'⬜' * empty_chars} {int(percentage)}%"
+        if width == _BAR_WIDTH:
+            # Горячий путь: строка бара уже собрана заранее
+            return f"{_BAR_CACHE[bar_char][filled_chars]} {int(percentage)}%"
+        return f"{bar_char * filled_chars}{'⬜' * (width - filled_chars)} {int(percentage)}%"
 
     def generate_nutrient_progress_bar(self, value: float, target: Optional[float], nutrient_type: str, width: int = 10) -> str:
         """
@@ -707,57 +1014,79 @@ class DBUserData:
         """
         if target is None or target <= 0:
             # Если цель не установлена, используем стандартные значения в зависимости от типа нутриента
-            if nutrient_type == "protein":
-                target = 75  # 75г белка - стандартная рекомендация
-            elif nutrient_type == "fat":
-                target = 60  # 60г жиров - стандартная рекомендация
-            elif nutrient_type == "carbs":
-                target = 250  # 250г углеводов - стандартная рекомендация
-            elif nutrient_type == "fiber":
-                target = 25  # 25г клетчатки - стандартная рекомендация
-            elif nutrient_type == "sugar":
-                target = 50  # 50г сахара - верхний предел по рекомендациям ВОЗ
-            elif nutrient_type == "sodium":
-                target = 2300  # 2300мг натрия - рекомендация ВОЗ
-            elif nutrient_type == "cholesterol":
-                target = 300  # 300мг холестерина - стандартная рекомендация
+            target = _DEFAULT_NUTRIENT_TARGETS.get(nutrient_type, 0)
 
         # Рассчитываем процент выполнения
         target_value = float(target) if target else 0
         percentage = min(100, int(value / target_value * 100)) if target_value > 0 else 0
         filled_chars = min(int(percentage / 100 * width), width)
-        empty_chars = width - filled_chars
-
-        # Выбираем эмодзи в зависимости от типа нутриента
-        if nutrient_type == "protein":
-            bar_char = "🟩"  # Синий для белков
-        elif nutrient_type == "fat":
-            bar_char = "🟩"  # Жёлтый для жиров
-        elif nutrient_type == "carbs":
-            bar_char = "🟩"  # Оранжевый для углеводов
-        elif nutrient_type == "fiber":
-            bar_char = "🟩"  # Зелёный для клетчатки
-        elif nutrient_type == "sugar":
-            bar_char = "🟩"  # Фиолетовый для сахара
-        elif nutrient_type == "sodium":
-            bar_char = "🟩"  # Белый для натрия
-        elif nutrient_type == "cholesterol":
-            bar_char = "🟩"  # Красный для холестерина
-        else:
-            bar_char = "🟩"  # Чёрный для неизвестного типа
-
-        return f"{bar_char * filled_chars}{'⬜' * empty_chars} {int(percentage)}%"
 
-# Кэш данных пользователей для оптимизации
-db_user_data_cache: Dict[int, DBUserData] = {}
-
-# Инициализация базы данных
-init_db()
+        # Все нутриенты рисуются зеленым
+        bar_char = "🟩"
+
+        if width == _BAR_WIDTH:
+            return f"{_BAR_CACHE[bar_char][filled_chars]} {int(percentage)}%"
+        return f"{bar_char * filled_chars}{'⬜' * (width - filled_chars)} {int(percentage)}%"
+
+# Кэш данных пользователей для оптимизации.
+# Ограничен по размеру (LRU-вытеснение), чтобы память не росла бесконечно
+# на публичном боте, и защищен блокировкой от гонки при первом обращении.
+_USER_CACHE_MAXSIZE = 10_000
+db_user_data_cache: "OrderedDict[int, DBUserData]" = OrderedDict()
+_user_cache_lock = threading.Lock()
+
+def _preload_users() -> None:
+    """Прогреть кэш пользователей одним запросом вместо SELECT на каждого"""
+    try:
+        with session_scope() as db:
+            for user in db.query(User).yield_per(1000):
+                if len(db_user_data_cache) >= _USER_CACHE_MAXSIZE:
+                    break
+                db_user_data_cache[user.id] = DBUserData.from_db_row(user)
+        logger.info(f"Кэш пользователей прогрет: {len(db_user_data_cache)} записей")
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка при прогреве кэша пользователей: {e}")
+
+def initialize() -> None:
+    """Создать схему БД и прогреть кэш пользователей.
+
+    Вызывается один раз из точки входа бота; сам импорт модуля больше
+    не выполняет DDL и запросов к базе.
+    """
+    init_db()
+    _preload_users()
 
 # Функция для получения данных пользователя
+def peek_user_data(user_id: int) -> Optional[DBUserData]:
+    """Достать пользователя из кэша без обращения к БД (None при промахе)"""
+    with _user_cache_lock:
+        user_data = db_user_data_cache.get(user_id)
+        if user_data is not None:
+            # Помечаем пользователя как недавно использованного
+            db_user_data_cache.move_to_end(user_id)
+        return user_data
+
 def get_user_data(user_id: int) -> DBUserData:
     """Получить или создать данные пользователя из базы данных"""
     # Сначала проверяем кэш, чтобы сократить количество обращений к БД
-    if user_id not in db_user_data_cache:
-        db_user_data_cache[user_id] = DBUserData(user_id)
-    return db_user_data_cache[user_id]
\ No newline at end of file
+    user_data = peek_user_data(user_id)
+    if user_data is not None:
+        return user_data
+
+    # Загрузка из БД идет вне блокировки: медленный SELECT первого
+    # обращения одного пользователя не должен останавливать обработчики
+    # остальных на общем локе кэша
+    user_data = DBUserData(user_id)
+
+    with _user_cache_lock:
+        # Двойная проверка: параллельный обработчик мог вставить свой
+        # экземпляр раньше — используем его, чтобы кэш дня оставался общим
+        existing = db_user_data_cache.get(user_id)
+        if existing is not None:
+            db_user_data_cache.move_to_end(user_id)
+            return existing
+        db_user_data_cache[user_id] = user_data
+        # Вытесняем самого давно не использовавшегося пользователя
+        if len(db_user_data_cache) > _USER_CACHE_MAXSIZE:
+            db_user_data_cache.popitem(last=False)
+    return user_data
\ No newline at end of file
@@ -1,15 +1,36 @@
+import asyncio
 import logging
 import os
+import inspect
+import re
+import secrets
 from datetime import datetime, date
 from typing import Optional, Dict, List, Any
 import io
-import base64
-from aiogram import Dispatcher, types, F, Router
+from collections import OrderedDict, defaultdict
+from time import monotonic
+
+try:
+    # Pillow нужен только для ужатия слишком больших фото перед OpenAI
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from aiogram import Bot, Dispatcher, types, F, Router
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import Command, CommandStart, StateFilter
 from aiogram.types import Message, CallbackQuery, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import (
+    EditMessageCaption,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    SendMessage,
+    SendPhoto,
+)
 
 from bot.keyboards import (
     get_main_keyboard,
@@ -22,16 +43,337 @@ from bot.keyboards import (
     get_kbju_format_keyboard,
     get_improved_stats_keyboard
 )
-from bot.db_storage import DBUserData, get_user_data
+from bot.db_storage import DBUserData, format_date, get_user_data, peek_user_data
 from bot.openai_integration import analyze_food_image
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+
+# Метаданные нутриентов для общего рендера строк сводки:
+# ключ в stats -> (подпись, лимит по умолчанию, единица измерения)
+_NUTRIENT_META = {
+    "protein": ("🥩 Белки", 75, "г"),
+    "fat": ("🧈 Жиры", 60, "г"),
+    "carbs": ("🍚 Углеводы", 250, "г"),
+    "fiber": ("🌱 Клетчатка", 30, "г"),
+    "sugar": ("🟣 Сахар", 50, "г"),
+    "sodium": ("⚪ Натрий", 2300, "мг"),
+    "cholesterol": ("🔴 Холестерин", 300, "мг"),
+}
+
+def _render_nutrient_lines(user_data: DBUserData, stats: Dict[str, Any], keys) -> str:
+    """Собрать строки "нутриент: значение/лимит" с прогресс-барами.
+
+    Один общий цикл вместо трех копий блока "достать лимит, подставить
+    дефолт, построить бар, склеить строку" в сводке, подтверждении и
+    детальном экране.
+    """
+    parts = []
+    for key in keys:
+        label, default_target, unit = _NUTRIENT_META[key]
+        target = stats.get(f"{key}_limit") or default_target
+        value = stats.get(key, 0)
+        bar = user_data.generate_nutrient_progress_bar(value, target, key)
+        parts.append(f"{label}: {value}/{target}{unit}\n{bar}\n")
+    return "".join(parts)
+
+async def _render_screen(callback_query: CallbackQuery, text: str, keyboard=None):
+    """Отрисовать экран поверх сообщения с кнопкой.
+
+    Один edit_text вместо пары answer + delete — вдвое меньше запросов
+    к Bot API на каждое нажатие. Если сообщение отредактировать нельзя
+    (слишком старое), откатываемся к отправке нового.
+    """
+    try:
+        await callback_query.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    except TelegramBadRequest as e:
+        err = str(e)
+        if "not modified" in err:
+            # Текст и клавиатура уже в актуальном состоянии
+            pass
+        elif "can't be edited" in err:
+            await callback_query.message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+        else:
+            raise
+
+# Кэш file_id -> file_path: путь файла стабилен на время жизни file_id,
+# так что ретраи того же фото не ходят в Telegram за ним повторно
+_FILE_PATH_CACHE_MAXSIZE = 4096
+_FILE_PATH_CACHE_TTL = 3600  # секунд
+_file_path_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+async def _get_file_path(bot, file_id: str) -> str:
+    """Получить file_path для file_id, используя кэш с TTL"""
+    cached = _file_path_cache.get(file_id)
+    if cached is not None:
+        saved_at, file_path = cached
+        if monotonic() - saved_at <= _FILE_PATH_CACHE_TTL:
+            _file_path_cache.move_to_end(file_id)
+            return file_path
+        del _file_path_cache[file_id]
+
+    file_info = await bot.get_file(file_id)
+    _file_path_cache[file_id] = (monotonic(), file_info.file_path)
+    if len(_file_path_cache) > _FILE_PATH_CACHE_MAXSIZE:
+        _file_path_cache.popitem(last=False)
+    return file_info.file_path
+
+async def _answer_and_delete(callback_query: CallbackQuery, text: str, keyboard=None):
+    """Отправить новый экран и удалить старое сообщение параллельно.
+
+    Запросы к Bot API не зависят друг от друга; ошибка отправки
+    пробрасывается, неудачное удаление только логируется.
+    """
+    results = await asyncio.gather(
+        callback_query.message.answer(text, parse_mode="HTML", reply_markup=keyboard),
+        callback_query.message.delete(),
+        return_exceptions=True,
+    )
+    if isinstance(results[0], Exception):
+        raise results[0]
+    if isinstance(results[1], Exception):
+        logger.warning(f"Не удалось удалить сообщение: {results[1]}")
+
+# Результаты анализа до подтверждения: токен в callback_data кнопки
+# ссылается сюда, так что подтверждение не делает round-trip в FSM-хранилище
+# и не застревает в состоянии, если пользователь так и не нажал кнопку
+_PENDING_ANALYSIS_MAXSIZE = 2048
+_PENDING_ANALYSIS_TTL = 600  # секунд
+_pending_analyses: "OrderedDict[str, tuple]" = OrderedDict()
+
+def _store_analysis(analysis: Dict[str, Any]) -> str:
+    """Сохранить результат анализа и вернуть токен для кнопки подтверждения"""
+    token = secrets.token_urlsafe(8)
+    _pending_analyses[token] = (monotonic(), analysis)
+    if len(_pending_analyses) > _PENDING_ANALYSIS_MAXSIZE:
+        _pending_analyses.popitem(last=False)
+    return token
+
+def _pop_analysis(token: str) -> Optional[Dict[str, Any]]:
+    """Забрать результат анализа по токену (None, если истек или не найден)"""
+    cached = _pending_analyses.pop(token, None)
+    if cached is None:
+        return None
+    saved_at, analysis = cached
+    if monotonic() - saved_at > _PENDING_ANALYSIS_TTL:
+        return None
+    return analysis
+
+# Защита от повторной доставки callback_query: Telegram перепосылает
+# нажатие, если бот не успел ответить за несколько секунд, а двойное
+# подтверждение или удаление записи — это двойная запись в БД
+_SEEN_CALLBACK_MAXSIZE = 4096
+_SEEN_CALLBACK_TTL = 30  # секунд
+_seen_callbacks: "OrderedDict[str, float]" = OrderedDict()
+
+def _first_delivery(callback_query: CallbackQuery) -> bool:
+    """True только для первой доставки данного callback_query"""
+    now = monotonic()
+    seen_at = _seen_callbacks.get(callback_query.id)
+    if seen_at is not None and now - seen_at <= _SEEN_CALLBACK_TTL:
+        return False
+    _seen_callbacks[callback_query.id] = now
+    _seen_callbacks.move_to_end(callback_query.id)
+    if len(_seen_callbacks) > _SEEN_CALLBACK_MAXSIZE:
+        _seen_callbacks.popitem(last=False)
+    return True
+
+# Блокировка на чат: серия фото от одного пользователя анализируется
+# по очереди (и не плодит гонок в FSM), чаты между собой не ждут друг друга
+_chat_locks: "defaultdict[int, asyncio.Lock]" = defaultdict(asyncio.Lock)
+
+# Сильные ссылки на фоновые задачи: без них сборщик мусора может снять
+# задачу на лету, а ее исключение всплывет лишь как
+# "Task exception was never retrieved" без стека в наших логах
+_background_tasks: "set[asyncio.Task]" = set()
+
+def _on_background_done(task: "asyncio.Task") -> None:
+    """Снять ссылку на завершенную задачу и залогировать ее ошибку"""
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Ошибка фоновой задачи: {task.exception()!r}")
+
+def _spawn_background(coro) -> "asyncio.Task":
+    """Запустить фоновую задачу, удерживая ссылку до ее завершения"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_on_background_done)
+    return task
+
+class _TokenBucket:
+    """Токен-бакет для исходящих запросов к Bot API.
+
+    Телеграм режет бота на ~30 сообщений/с глобально и ~1/с в один чат;
+    при всплеске нагрузки лучше коротко подождать свой слот, чем словить
+    429 и каскад ретраев.
+    """
+
+    __slots__ = ("_rate", "_capacity", "_tokens", "_updated", "_lock")
+
+    def __init__(self, rate: float, burst: float):
+        self._rate = rate
+        self._capacity = burst
+        self._tokens = burst
+        self._updated = monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            now = monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+# Глобальный лимит всего бота и лимит на отдельный чат
+_global_send_bucket = _TokenBucket(rate=30, burst=30)
+_chat_send_buckets: "defaultdict[int, _TokenBucket]" = defaultdict(
+    lambda: _TokenBucket(rate=1, burst=3)
+)
+
+async def _send_slot(chat_id: int) -> None:
+    """Дождаться слота на отправку сообщения в указанный чат"""
+    await _global_send_bucket.acquire()
+    await _chat_send_buckets[chat_id].acquire()
+
+# Методы Bot API, подпадающие под лимиты на отправку сообщений.
+# Удаления, answerCallbackQuery и chat action лимитируются мягче
+# и слот не расходуют
+_THROTTLED_METHODS = (
+    SendMessage,
+    SendPhoto,
+    EditMessageText,
+    EditMessageCaption,
+    EditMessageReplyMarkup,
+)
+
+class _ThrottleSendMiddleware(BaseRequestMiddleware):
+    """Единая точка троттлинга исходящих запросов к Bot API.
+
+    Перехват на уровне сессии пропускает через токен-бакеты любой путь
+    отправки — экраны, подсказки, карточку анализа — без ручного вызова
+    _send_slot в каждом обработчике.
+    """
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, _THROTTLED_METHODS):
+            chat_id = getattr(method, "chat_id", None)
+            if chat_id is not None:
+                await _send_slot(chat_id)
+        return await make_request(bot, method)
+
+def setup_send_throttling(bot: Bot) -> None:
+    """Повесить троттлинг исходящих сообщений на сессию бота"""
+    bot.session.middleware(_ThrottleSendMiddleware())
+
+# Валидатор лимита калорий: положительное целое до 5 знаков.
+# Отсекает и мусор, и абсурдно длинные строки цифр до вызова int()
+_LIMIT_RE = re.compile(r"[1-9]\d{0,4}")
+
+# Дата DD.MM.YYYY и название блюда, зашитые в текст сообщения:
+# компилируем один раз вместо import re + re.search в каждом callback
+_DATE_RE = re.compile(r"(\d{2})\.(\d{2})\.(\d{4})")
+_MEAL_RE = re.compile(r"🍽 <b>(.*?)</b>")
+
+async def _get_user_data(user_id: int) -> DBUserData:
+    """Достать данные пользователя, не блокируя event loop на промахе кэша.
+
+    Попадание в кэш обслуживается синхронно (поиск в словаре); первое
+    обращение тянет SELECT и прогрев статистики из БД, поэтому уходит
+    в поток, как и остальные запросы к базе.
+    """
+    user_data = peek_user_data(user_id)
+    if user_data is None:
+        user_data = await asyncio.to_thread(get_user_data, user_id)
+    return user_data
+
+async def _handler_ctx(message: Optional[Message], callback_query: Optional[CallbackQuery],
+                       user_data: Optional[DBUserData] = None):
+    """Определить пользователя, сообщение-цель и его данные для обработчика.
+
+    Экраны вызываются и по команде, и по кнопке; этот пролог одинаков
+    везде, так что выбираем источник и достаем данные пользователя в
+    одном месте. Если вызывающий уже держит user_data в руках, он
+    передает его сюда вместо повторного поиска.
+    """
+    if callback_query:
+        user_id = callback_query.from_user.id
+        msg_obj = callback_query.message
+    else:
+        user_id = message.from_user.id
+        msg_obj = message
+    if user_data is None:
+        user_data = await _get_user_data(user_id)
+    return user_id, msg_obj, user_data
+
+def _slice_date(text: str, start: int) -> Optional[date]:
+    """Разобрать DD.MM.YYYY с фиксированного смещения срезами, без regex"""
+    if len(text) < start + 10 or text[start + 2] != "." or text[start + 5] != ".":
+        return None
+    try:
+        return date(
+            int(text[start + 6:start + 10]),
+            int(text[start + 3:start + 5]),
+            int(text[start:start + 2]),
+        )
+    except ValueError:
+        return None
+
+def _parse_date_from_text(text: Optional[str]) -> Optional[date]:
+    """Извлечь дату в формате DD.MM.YYYY из текста сообщения.
+
+    Возвращает None, если даты в тексте нет или она некорректна —
+    вызывающий подставляет свою дату по умолчанию.
+    """
+    if not text:
+        return None
+    # Быстрый путь: во всех экранах дата стоит сразу после " за "
+    # ("Сводка питания за 15.03.2025"), так что хватает find + срезов
+    idx = text.find(" за ")
+    if idx != -1:
+        parsed = _slice_date(text, idx + 4)
+        if parsed is not None:
+            return parsed
+    # Запасной путь для текстов с другой компоновкой
+    match = _DATE_RE.search(text)
+    if not match:
+        return None
+    try:
+        day, month, year = map(int, match.groups())
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+# Модель зрения не выигрывает от разрешения выше ~1 мегапикселя,
+# а байты фото напрямую конвертируются в время и стоимость запроса
+_MAX_PHOTO_EDGE = 1024
+
+def prepare_photo_payload(buf: io.BytesIO, width: int, height: int):
+    """Подготовить байты фото к отправке в OpenAI.
+
+    Фото крупнее _MAX_PHOTO_EDGE по длинной стороне пересжимается в JPEG
+    1024px: меньше байт на выгрузку, base64 и вход модели. Без Pillow или
+    при ошибке декодирования отправляется оригинал.
+    """
+    if Image is None or max(width, height) <= _MAX_PHOTO_EDGE:
+        return buf.getbuffer()
+
+    try:
+        img = Image.open(buf)
+        img.thumbnail((_MAX_PHOTO_EDGE, _MAX_PHOTO_EDGE), Image.LANCZOS)
+        out = io.BytesIO()
+        img.convert("RGB").save(out, "JPEG", quality=85)
+        return out.getbuffer()
+    except Exception as e:
+        logger.warning(f"Не удалось ужать фото, отправляем оригинал: {e}")
+        return buf.getbuffer()
+
 # States
 class CalorieTrackerStates(StatesGroup):
     waiting_for_photo = State()
-    waiting_for_confirmation = State()
     waiting_for_calorie_limit = State()
     waiting_for_timezone = State()
     waiting_for_kbju_format = State()
@@ -45,79 +387,107 @@ class CalorieTrackerStates(StatesGroup):
     waiting_for_weight = State()
     waiting_for_body_fat = State()
 
-# Функция get_user_data уже импортирована из db_storage, используем её напрямую
+# Данные пользователя достаются через _get_user_data: кэш — синхронно, БД — в потоке
 # Другое имя для совместимости не требуется, так как имена совпадают
 
 # Command handlers
+# Статические тексты ответов собираются один раз при импорте,
+# а не пересобираются из частей на каждую команду
+_WELCOME_TMPL = (
+    "👋 Добро пожаловать, {user_name}!\n\n"
+    "Я бот для подсчёта калорий. Вот что я умею:\n"
+    "• Анализировать фото еды и считать калории 📸\n"
+    "• Отслеживать ваше питание в течение дня 📊\n"
+    "• Подсчитывать белки, жиры и углеводы 📝\n"
+    "• Показывать историю питания за последние 7 дней 📅\n"
+    "• Устанавливать персональный лимит калорий ⚙️\n\n"
+    "Используйте кнопки ниже или просто отправьте фото еды, чтобы начать!"
+)
+
+_HELP_TEXT = (
+    "🔍 <b>Как пользоваться ботом:</b>\n\n"
+    "1️⃣ <b>Отправьте фото еды</b> - я проанализирую и посчитаю калории\n"
+    "2️⃣ <b>Подтвердите информацию</b> - если всё верно, я добавлю данные в дневник\n"
+    "3️⃣ <b>Посмотрите статистику</b> - нажмите на кнопку «📊 Сводка питания»\n"
+    "4️⃣ <b>Просмотрите приемы пищи</b> - нажмите на кнопку «🍽️ Приемы пищи»\n"
+    "5️⃣ <b>Настройте лимит калорий</b> - нажмите на кнопку «⚙️ Настройки»\n\n"
+    "<b>Основные функции:</b>\n"
+    "• Анализ фото еды и распознавание калорийности\n"
+    "• Отслеживание питания по дням с возможностью листать историю\n"
+    "• Просмотр и удаление отдельных приемов пищи\n"
+    "• Прогресс-бар потребления калорий\n"
+    "• Установка персонального лимита калорий"
+)
+
+_KBJU_FORMAT_TEXT = (
+    "📊 <b>Настройка лимитов КБЖУ</b>\n\n"
+    "Выберите способ установки лимитов белков, жиров и углеводов:\n\n"
+    "<b>✍️ Ввести вручную</b> - установить каждое значение отдельно\n"
+    "<b>🧮 Рассчитать по весу</b> - расчёт на основе вашего веса и % жира в теле"
+)
+
+_FAT_LIMIT_PROMPT = (
+    "🧈 <b>Установка лимита жиров</b>\n\n"
+    "Введите дневной лимит жиров в граммах:"
+)
+
+_CARBS_LIMIT_PROMPT = (
+    "🍚 <b>Установка лимита углеводов</b>\n\n"
+    "Введите дневной лимит углеводов в граммах:"
+)
+
+_FIBER_LIMIT_PROMPT = (
+    "🌱 <b>Установка лимита клетчатки</b>\n\n"
+    "Введите дневной лимит клетчатки в граммах:\n"
+    "(это необязательный параметр, введите 0, если не хотите устанавливать лимит)"
+)
+
+_BODY_FAT_PROMPT = (
+    "📏 <b>Установка процента жира в теле</b>\n\n"
+    "Введите процент жира в теле (число от 5 до 50):\n"
+    "Примерные значения:\n"
+    "- Мужчины: 10-25%\n"
+    "- Женщины: 18-30%\n"
+    "Если вы не знаете свой процент жира, введите примерное значение:"
+)
+
 async def cmd_start(message: Message, state: FSMContext):
     """Handle /start command"""
     user_id = message.from_user.id
     user_name = message.from_user.first_name
     
     # Initialize user data if not exists
-    user_data = get_user_data(user_id)
+    user_data = await _get_user_data(user_id)
     
-    await state.clear()  # Clear any active states
+    # Фоново прогреваем статистику за неделю одним сгруппированным
+    # запросом: навигация по истории дальше идет из кэша дня
+    _spawn_background(asyncio.to_thread(user_data.get_last_week_stats))
     
-    # Welcome message
-    welcome_text = (
-        f"👋 Добро пожаловать, {user_name}!\n\n"
-        f"Я бот для подсчёта калорий. Вот что я умею:\n"
-        f"• Анализировать фото еды и считать калории 📸\n"
-        f"• Отслеживать ваше питание в течение дня 📊\n"
-        f"• Подсчитывать белки, жиры и углеводы 📝\n"
-        f"• Показывать историю питания за последние 7 дней 📅\n"
-        f"• Устанавливать персональный лимит калорий ⚙️\n\n"
-        f"Используйте кнопки ниже или просто отправьте фото еды, чтобы начать!"
-    )
+    await state.clear()  # Clear any active states
     
     # Отправляем основную клавиатуру
-    await message.answer(welcome_text, 
+    await message.answer(_WELCOME_TMPL.format(user_name=user_name), 
                          reply_markup=get_main_keyboard(), 
                          parse_mode="HTML")
 
 async def cmd_help(message: Message):
     """Handle /help command"""
-    help_text = (
-        "🔍 <b>Как пользоваться ботом:</b>\n\n"
-        "1️⃣ <b>Отправьте фото еды</b> - я проанализирую и посчитаю калории\n"
-        "2️⃣ <b>Подтвердите информацию</b> - если всё верно, я добавлю данные в дневник\n"
-        "3️⃣ <b>Посмотрите статистику</b> - нажмите на кнопку «📊 Сводка питания»\n"
-        "4️⃣ <b>Просмотрите приемы пищи</b> - нажмите на кнопку «🍽️ Приемы пищи»\n"
-        "5️⃣ <b>Настройте лимит калорий</b> - нажмите на кнопку «⚙️ Настройки»\n\n"
-        "<b>Основные функции:</b>\n"
-        "• Анализ фото еды и распознавание калорийности\n"
-        "• Отслеживание питания по дням с возможностью листать историю\n"
-        "• Просмотр и удаление отдельных приемов пищи\n"
-        "• Прогресс-бар потребления калорий\n"
-        "• Установка персонального лимита калорий"
-    )
-    
-    await message.answer(help_text, parse_mode="HTML")
+    await message.answer(_HELP_TEXT, parse_mode="HTML")
 
 # Функции для отображения сводки питания
 async def show_stats(message: Message = None, callback_query: CallbackQuery = None, 
                     current_date: Optional[date] = None, edit_message: bool = False):
     """Show nutrition stats for a specific date"""
     #await callback_query.answer(current_date.strftime("%d.%m.%Y"))
-    # Определяем либо из сообщения, либо из callback_query
-    if callback_query:
-        user_id = callback_query.from_user.id
-        msg_obj = callback_query.message
-    else:
-        user_id = message.from_user.id
-        msg_obj = message
+    user_id, msg_obj, user_data = await _handler_ctx(message, callback_query)
     
     # Если дата не указана, используем сегодня в часовом поясе пользователя
     if current_date is None:
-        user_data = get_user_data(user_id)
         current_date = user_data.get_current_date()
-    else:
-        user_data = get_user_data(user_id)
 
     #raise Exception(f'{current_date}')
     
-    stats = user_data.get_stats_by_date(current_date)
+    stats = await asyncio.to_thread(user_data.get_stats_by_date, current_date)
     
     # Если нет записей за эту дату
     if stats["entries"] == 0:
@@ -144,46 +514,8 @@ async def show_stats(message: Message = None, callback_query: CallbackQuery = No
         # Используем обычную клавиатуру навигации по датам
         keyboard = get_stats_keyboard(current_date)
     else:
-        # Создаем прогресс-бары для всех нутриентов
+        # Бар калорий строится отдельно, строки нутриентов — общим рендером
         calorie_bar = user_data.generate_calorie_progress_bar(stats["calorie_percentage"])
-        
-        # Получаем целевые значения БЖУ из данных пользователя
-        protein_target = stats.get('protein_limit', 75)
-        fat_target = stats.get('fat_limit', 60)
-        carbs_target = stats.get('carbs_limit', 250)
-        fiber_target = stats.get('fiber_limit', 30)
-        sugar_target = stats.get('sugar_limit', 50)
-        sodium_target = stats.get('sodium_limit', 2300)
-        cholesterol_target = stats.get('cholesterol_limit', 300)
-
-        # Проверка на None и установка дефолтных значений
-        if protein_target is None:
-            protein_target = 75
-        if carbs_target is None:
-            carbs_target = 250
-        if fat_target is None:
-            fat_target = 60
-        if fiber_target is None:
-            fiber_target = 30
-        if sugar_target is None:
-            sugar_target = 50
-        if sodium_target is None:
-            sodium_target = 2300
-        if cholesterol_target is None:
-            cholesterol_target = 300
-        
-        # Создаем прогресс-бары с текущими/целевыми значениями
-        protein_bar = user_data.generate_nutrient_progress_bar(stats["protein"], protein_target, "protein")
-        fat_bar = user_data.generate_nutrient_progress_bar(stats["fat"], fat_target, "fat")
-        carbs_bar = user_data.generate_nutrient_progress_bar(stats["carbs"], carbs_target, "carbs")
-        fiber_bar = user_data.generate_nutrient_progress_bar(stats.get("fiber", 0), fiber_target, "fiber")
-        
-        # Создаем прогресс-бары для новых нутриентов
-        sugar_bar = user_data.generate_nutrient_progress_bar(stats.get("sugar", 0), sugar_target, "sugar")
-        sodium_bar = user_data.generate_nutrient_progress_bar(stats.get("sodium", 0), sodium_target, "sodium")
-        cholesterol_bar = user_data.generate_nutrient_progress_bar(stats.get("cholesterol", 0), cholesterol_target, "cholesterol")
-        
-        # Создаем текст сообщения с прогресс-барами
         limit_text = f"Лимит калорий: {stats['calorie_limit']} ккал\n" if stats['calorie_limit'] else ""
         
         # Основные нутриенты всегда отображаются
@@ -194,10 +526,7 @@ async def show_stats(message: Message = None, callback_query: CallbackQuery = No
             f"Калории: {stats['calories']}/{stats.get('calorie_limit', '—')} ккал\n"
             f"{calorie_bar}\n\n"
             f"<b>Основные нутриенты:</b>\n"
-            f"🥩 Белки: {stats['protein']}/{protein_target}г\n{protein_bar}\n"
-            f"🧈 Жиры: {stats['fat']}/{fat_target}г\n{fat_bar}\n"
-            f"🍚 Углеводы: {stats['carbs']}/{carbs_target}г\n{carbs_bar}\n"
-            f"🌱 Клетчатка: {stats.get('fiber', 0)}/{fiber_target}г\n{fiber_bar}\n"
+            + _render_nutrient_lines(user_data, stats, ("protein", "fat", "carbs", "fiber"))
         )
         
         # Используем улучшенную клавиатуру со всеми нутриентами
@@ -240,39 +569,31 @@ async def show_stats(message: Message = None, callback_query: CallbackQuery = No
 async def show_meals(message: Message = None, callback_query: CallbackQuery = None, 
                      current_date: Optional[date] = None, page: int = 0, edit_message: bool = False):
     """Show meals list for a specific date"""
-    # Определяем либо из сообщения, либо из callback_query
-    if callback_query:
-        user_id = callback_query.from_user.id
-        msg_obj = callback_query.message
-    else:
-        user_id = message.from_user.id
-        msg_obj = message
+    user_id, msg_obj, user_data = await _handler_ctx(message, callback_query)
     
     # Если дата не указана, используем сегодня в часовом поясе пользователя
     if current_date is None:
-        user_data = get_user_data(user_id)
         current_date = user_data.get_current_date()
-    else:
-        user_data = get_user_data(user_id)
     
-    # Получаем приемы пищи за указанную дату
-    meals = user_data.get_entries_by_date(current_date)
+    # Получаем одну страницу приемов пищи: SQL отдает только показываемые
+    # записи плюс общее число за день
+    meals, total = await asyncio.to_thread(user_data.get_entries_page, current_date, page)
     
     # Если нет записей за эту дату
-    if not meals:
+    if total == 0:
         meals_text = (
-            f"🍽 <b>Приемы пищи за {current_date.strftime('%d.%m.%Y')}</b>\n\n"
+            f"🍽 <b>Приемы пищи за {format_date(current_date)}</b>\n\n"
             f"У вас нет записей о питании за этот день.\n\n"
             f"Отправьте фото еды, чтобы добавить новую запись."
         )
         keyboard = get_stats_keyboard(current_date)  # Используем обычную клавиатуру навигации
     else:
-        meals_text = f"🍽 <b>Приемы пищи за {current_date.strftime('%d.%m.%Y')}</b>\n\n"
-        meals_text += f"Всего записей: {len(meals)}\n\n"
+        meals_text = f"🍽 <b>Приемы пищи за {format_date(current_date)}</b>\n\n"
+        meals_text += f"Всего записей: {total}\n\n"
         meals_text += "Выберите запись для просмотра деталей и управления:"
         
         # Создаем клавиатуру со списком приемов пищи
-        keyboard = get_meals_keyboard(meals, page)
+        keyboard = get_meals_keyboard(meals, page, total=total)
     
     # Отправляем или редактируем сообщение в зависимости от контекста
     try:
@@ -310,17 +631,10 @@ async def show_meals(message: Message = None, callback_query: CallbackQuery = No
 # Функция главного меню удалена по запросу пользователя
 
 # Функция для отображения настроек
-async def show_settings(message: Message = None, callback_query: CallbackQuery = None):
+async def show_settings(message: Message = None, callback_query: CallbackQuery = None,
+                        user_data: Optional[DBUserData] = None):
     """Show settings"""
-    # Определяем либо из сообщения, либо из callback_query
-    if callback_query:
-        user_id = callback_query.from_user.id
-        msg_obj = callback_query.message
-    else:
-        user_id = message.from_user.id
-        msg_obj = message
-    
-    user_data = get_user_data(user_id)
+    user_id, msg_obj, user_data = await _handler_ctx(message, callback_query, user_data)
     current_limit = user_data.calorie_limit
     tz_code = user_data.timezone_code
     tz_offset = user_data.get_timezone_offset()
@@ -362,13 +676,8 @@ async def show_settings(message: Message = None, callback_query: CallbackQuery =
     
     try:
         if callback_query:
-            # Всегда отправляем новое сообщение вместо редактирования
-            await callback_query.message.answer(settings_text, parse_mode="HTML", reply_markup=keyboard)
-            # Удаляем старое сообщение
-            try:
-                await callback_query.message.delete()
-            except Exception as delete_err:
-                logger.warning(f"Не удалось удалить сообщение: {delete_err}")
+            # Редактируем сообщение с кнопкой вместо отправки нового
+            await _render_screen(callback_query, settings_text, keyboard)
             await callback_query.answer()
         else:
             await msg_obj.answer(settings_text, parse_mode="HTML", reply_markup=keyboard)
@@ -390,28 +699,75 @@ async def process_photo(message: Message, state: FSMContext):
     if not message.photo:
         return
     
-    # Notify user that processing is happening
-    processing_message = await message.answer("🔍 Анализирую вашу еду... Это может занять несколько секунд.")
+    # Отправляем уведомление параллельно со стартом анализа: ответ
+    # "Анализирую..." не задерживает резолв file_path и наоборот
+    processing_task = asyncio.create_task(
+        message.answer("🔍 Анализирую вашу еду... Это может занять несколько секунд.")
+    )
+    # Индикатор "печатает..." в шапке чата на время анализа
+    _spawn_background(_send_typing_action(message.bot, message.chat.id))
     
+    # Скачивание и запрос к OpenAI занимают секунды — уводим их в фоновую
+    # задачу, чтобы не держать обработчик апдейта на это время
+    _spawn_background(_analyze_photo_task(message, state, processing_task))
+
+# Потолок ожидания анализа одного фото: семафор в openai_integration
+# ограничивает параллельные запросы, поэтому сюда входит и очередь за ним,
+# и ретраи при троттлинге — таймаут взят с запасом над суммой этих этапов
+_ANALYSIS_TIMEOUT = 90.0
+
+async def _send_typing_action(bot: Bot, chat_id: int):
+    """Показать индикатор "печатает..." — сбои индикатора некритичны"""
     try:
-        # Get the largest photo
-        photo = message.photo[-1]
-        file_info = await message.bot.get_file(photo.file_id)
-        downloaded_file = await message.bot.download_file(file_info.file_path)
-        
-        # Convert to base64
-        photo_bytes = downloaded_file.read()
-        base64_image = base64.b64encode(photo_bytes).decode('utf-8')
-        
-        # Analyze image with OpenAI
-        analysis_result = await analyze_food_image(base64_image)
+        await bot.send_chat_action(chat_id, "typing")
+    except Exception as e:
+        logger.debug(f"Не удалось отправить chat action: {e}")
+
+async def _analyze_photo_task(message: Message, state: FSMContext, processing_task: "asyncio.Task[Message]"):
+    """Фоновая часть обработки фото: скачивание, анализ, ответ пользователю"""
+    async with _chat_locks[message.chat.id]:
+        await _analyze_photo(message, state, processing_task)
+
+async def _analyze_photo(message: Message, state: FSMContext, processing_task: "asyncio.Task[Message]"):
+    """Скачать фото, получить анализ от OpenAI и показать карточку результата"""
+    try:
+        # Берем наименьший вариант фото с длинной стороной >= 1024px:
+        # Telegram уже отдает готовые уменьшенные размеры, так что
+        # качать максимальный оригинал и ужимать его локально не нужно
+        photo = next(
+            (p for p in message.photo if max(p.width, p.height) >= _MAX_PHOTO_EDGE),
+            message.photo[-1]
+        )
+        file_path = await _get_file_path(message.bot, photo.file_id)
+
+        # Скачиваем сразу в заранее созданный буфер: getbuffer() отдает
+        # memoryview без копирования всего файла в отдельный bytes
+        buf = io.BytesIO()
+        await message.bot.download_file(file_path, destination=buf)
+        
+        # Подготовка полезной нагрузки (Pillow-ресайз при крупном фото) —
+        # CPU-работа, выполняем ее вне event loop
+        payload = await asyncio.to_thread(prepare_photo_payload, buf, photo.width, photo.height)
+        try:
+            # Зависший запрос к OpenAI не должен бесконечно держать лок
+            # чата — по таймауту показываем обычную ошибку анализа
+            analysis_result = await asyncio.wait_for(
+                analyze_food_image(payload), timeout=_ANALYSIS_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            logger.error(f"Анализ фото не уложился в {_ANALYSIS_TIMEOUT:.0f} с")
+            analysis_result = None
+
+        # К этому моменту "Анализирую..." давно доставлено — его отправка
+        # шла параллельно со скачиванием фото и запросом к OpenAI
+        processing_message = await processing_task
         
         # Проверяем результат анализа
         if not analysis_result:
-            # Если анализ не удался, сообщаем пользователю
+            # Если анализ не удался, сообщаем пользователю: редактируем
+            # сообщение о процессе вместо удаления и отправки нового
             logger.error("OpenAI API error or quota exceeded. Failed to analyze food image.")
-            await processing_message.delete()
-            await message.answer(
+            await processing_message.edit_text(
                 "❌ К сожалению, не удалось проанализировать фото еды. Это может быть связано с проблемами соединения "
                 "с OpenAI API или исчерпанием квоты запросов.\n\n"
                 "Пожалуйста, попробуйте повторить позже или обратитесь к администратору."
@@ -420,9 +776,6 @@ async def process_photo(message: Message, state: FSMContext):
             await state.clear()
             return
         
-        # Store analysis in state
-        await state.update_data(analysis=analysis_result)
-        
         # Format the results
         food_name = analysis_result.get('food_name', 'Неизвестное блюдо')
         calories = analysis_result.get('calories', 0)
@@ -434,6 +787,21 @@ async def process_photo(message: Message, state: FSMContext):
         sodium = analysis_result.get('sodium', 0)
         cholesterol = analysis_result.get('cholesterol', 0)
         
+        # Храним только поля, нужные подтверждению: caption бывает
+        # длиннее всех числовых полей вместе взятых, а после показа
+        # карточки он больше не используется
+        token = _store_analysis({
+            "food_name": food_name,
+            "calories": calories,
+            "protein": protein,
+            "fat": fat,
+            "carbs": carbs,
+            "fiber": fiber,
+            "sugar": sugar,
+            "sodium": sodium,
+            "cholesterol": cholesterol,
+        })
+        
         # Основные нутриенты всегда отображаются
         result_message = (
             f"🍽 <b>{food_name}</b>\n\n"
@@ -464,32 +832,30 @@ async def process_photo(message: Message, state: FSMContext):
             
         result_message += f"\n\nВсе верно? Если да, нажмите «Подтвердить» для сохранения в дневник питания."
         
-        # Delete processing message
-        try:
-            await message.bot.delete_message(chat_id=message.chat.id, message_id=processing_message.message_id)
-        except Exception as e:
-            logger.error(f"Error deleting processing message: {e}")
-        
-        # Send results with confirmation buttons
-        await message.answer(result_message, parse_mode="HTML", reply_markup=get_confirm_keyboard())
-        await state.set_state(CalorieTrackerStates.waiting_for_confirmation)
+        # Превращаем сообщение "Анализирую..." в карточку результата:
+        # один edit_text вместо пары delete_message + answer
+        await processing_message.edit_text(
+            result_message, parse_mode="HTML", reply_markup=get_confirm_keyboard(token)
+        )
         
     except Exception as e:
         logger.error(f"Error processing photo: {e}")
-        await message.answer(
-            "😔 Произошла ошибка при анализе фотографии. Пожалуйста, попробуйте еще раз.",
-            reply_markup=get_main_keyboard()
-        )
         try:
-            await message.bot.delete_message(chat_id=message.chat.id, message_id=processing_message.message_id)
-        except:
-            pass
+            processing_message = await processing_task
+            await processing_message.edit_text(
+                "😔 Произошла ошибка при анализе фотографии. Пожалуйста, попробуйте еще раз."
+            )
+        except Exception:
+            await message.answer(
+                "😔 Произошла ошибка при анализе фотографии. Пожалуйста, попробуйте еще раз.",
+                reply_markup=get_main_keyboard()
+            )
 
 # Обработка установки лимита калорий
 async def set_calorie_limit(callback_query: CallbackQuery, state: FSMContext):
     """Prompt user to set calorie limit"""
     user_id = callback_query.from_user.id
-    user_data = get_user_data(user_id)
+    user_data = await _get_user_data(user_id)
     current_limit = user_data.calorie_limit
     
     limit_text = (
@@ -498,14 +864,8 @@ async def set_calorie_limit(callback_query: CallbackQuery, state: FSMContext):
         f"Введите новый дневной лимит калорий (число):"
     )
     
-    # Отправляем новое сообщение вместо редактирования
-    await callback_query.message.answer(limit_text, parse_mode="HTML")
-    
-    # Удаляем старое сообщение
-    try:
-        await callback_query.message.delete()
-    except Exception as e:
-        logger.warning(f"Не удалось удалить сообщение: {e}")
+    # Редактируем сообщение с кнопкой вместо отправки нового
+    await _render_screen(callback_query, limit_text)
     
     await state.set_state(CalorieTrackerStates.waiting_for_calorie_limit)
     await callback_query.answer()
@@ -513,27 +873,27 @@ async def set_calorie_limit(callback_query: CallbackQuery, state: FSMContext):
 # Обработка подтверждения добавления еды
 async def process_confirmation(callback_query: CallbackQuery, state: FSMContext):
     """Process user confirmation of food analysis"""
+    if not _first_delivery(callback_query):
+        await callback_query.answer("Уже обработано")
+        return
+    
     user_id = callback_query.from_user.id
     
-    # Get analysis data from state
-    state_data = await state.get_data()
-    analysis = state_data.get("analysis")
+    # Достаем результат анализа по токену из callback_data; pop делает
+    # повторное нажатие той же кнопки безвредным
+    token = callback_query.data.partition(":")[2]
+    analysis = _pop_analysis(token)
     
     if not analysis:
-        # Отправляем новое сообщение вместо редактирования текущего
-        await callback_query.message.answer(
-            "😔 Произошла ошибка. Пожалуйста, попробуйте снова сфотографировать еду."
+        await _render_screen(
+            callback_query,
+            "😔 Карточка устарела. Пожалуйста, сфотографируйте еду еще раз."
         )
-        try:
-            await callback_query.message.delete()
-        except Exception as e:
-            logger.warning(f"Не удалось удалить сообщение: {e}")
-        await state.clear()
         await callback_query.answer()
         return
     
     # Save data to user storage
-    user_data = get_user_data(user_id)
+    user_data = await _get_user_data(user_id)
     
     # Извлекаем данные о нутриентах, включая дополнительные
     food_name = analysis.get('food_name', 'Неизвестное блюдо')
@@ -546,8 +906,10 @@ async def process_confirmation(callback_query: CallbackQuery, state: FSMContext)
     sodium = analysis.get('sodium', 0)
     cholesterol = analysis.get('cholesterol', 0)
     
-    # Добавляем запись со всеми нутриентами
-    entry = user_data.add_food_entry(
+    # Добавляем запись со всеми нутриентами и сразу получаем обновленную
+    # сводку за сегодня — одна транзакция вместо двух походов в БД
+    entry, today_stats = await asyncio.to_thread(
+        user_data.add_food_entry_with_stats,
         food_name=food_name,
         calories=calories,
         protein=protein,
@@ -559,56 +921,13 @@ async def process_confirmation(callback_query: CallbackQuery, state: FSMContext)
         cholesterol=cholesterol
     )
     
-    # Get updated stats
-    today_stats = user_data.get_today_stats()
-    
-    # Получаем целевые значения БЖУ из данных пользователя
-    protein_target = today_stats.get('protein_limit', 75)
-    fat_target = today_stats.get('fat_limit', 60)
-    carbs_target = today_stats.get('carbs_limit', 250)
-    fiber_target = today_stats.get('fiber_limit', 30)
-
-    if protein_target == None:
-        protein_target = 0
-    if carbs_target == None:
-        carbs_target = 0
-    if fat_target == None:
-        fat_target = 0
-    if fiber_target == None:
-        fiber_target = 0
-    
     # Create progress bars with current/target values
     calorie_bar = user_data.generate_calorie_progress_bar(today_stats["calorie_percentage"])
-    protein_bar = user_data.generate_nutrient_progress_bar(today_stats["protein"], protein_target, "protein")
-    fat_bar = user_data.generate_nutrient_progress_bar(today_stats["fat"], fat_target, "fat")
-    carbs_bar = user_data.generate_nutrient_progress_bar(today_stats["carbs"], carbs_target, "carbs")
-    fiber_bar = user_data.generate_nutrient_progress_bar(today_stats.get("fiber", 0), fiber_target, "fiber")
     
     # Prepare confirmation message
     calorie_limit = today_stats["calorie_limit"]
     limit_text = f"Лимит калорий: {calorie_limit} ккал\n" if calorie_limit else ""
     
-    # Определяем дополнительные нутриенты (если они есть)
-    fiber = analysis.get('fiber', 0)
-    sugar = analysis.get('sugar', 0)
-    sodium = analysis.get('sodium', 0)
-    cholesterol = analysis.get('cholesterol', 0)
-    
-    # Добавляем эти нутриенты в запись
-    if fiber > 0 or sugar > 0 or sodium > 0 or cholesterol > 0:
-        if entry:
-            # Обновляем запись с новыми нутриентами
-            try:
-                user_data.update_food_entry(
-                    entry_id=entry['id'],
-                    fiber=fiber,
-                    sugar=sugar,
-                    sodium=sodium,
-                    cholesterol=cholesterol
-                )
-            except Exception as e:
-                logger.error(f"Ошибка при обновлении дополнительных нутриентов: {e}")
-    
     # Создаем текст подтверждения
     confirm_text = (
         f"✅ <b>Запись добавлена в дневник!</b>\n\n"
@@ -620,25 +939,12 @@ async def process_confirmation(callback_query: CallbackQuery, state: FSMContext)
         f"Калории: {today_stats['calories']}/{today_stats.get('calorie_limit', '—')} ккал\n"
         f"{calorie_bar}\n\n"
         f"<b>Пищевая ценность:</b>\n"
-        f"🥩 Белки: {today_stats['protein']}/{protein_target}г\n{protein_bar}\n"
-        f"🧈 Жиры: {today_stats['fat']}/{fat_target}г\n{fat_bar}\n"
-        f"🍚 Углеводы: {today_stats['carbs']}/{carbs_target}г\n{carbs_bar}\n"
-        f"🌱 Клетчатка: {today_stats.get('fiber', 0)}/{fiber_target}г\n{fiber_bar}\n"
+        + _render_nutrient_lines(user_data, today_stats, ("protein", "fat", "carbs", "fiber"))
     )
     
-    # Всегда отправляем новое сообщение вместо редактирования
-    await callback_query.message.answer(
-        f"{confirm_text}\n\nЧто хотите сделать дальше?",
-        parse_mode="HTML"
-    )
-    
-    # Удаляем старое сообщение
-    try:
-        await callback_query.message.delete()
-    except Exception as e:
-        logger.warning(f"Не удалось удалить сообщение: {e}")
+    # Редактируем сообщение с кнопками подтверждения вместо отправки нового
+    await _render_screen(callback_query, f"{confirm_text}\n\nЧто хотите сделать дальше?")
     
-    await state.clear()
     await callback_query.answer()
 
 # Функция для обработки отмены
@@ -646,17 +952,8 @@ async def process_cancel(callback_query: CallbackQuery, state: FSMContext):
     """Cancel current operation"""
     await state.clear()
     
-    # Всегда отправляем новое сообщение вместо редактирования
-    await callback_query.message.answer(
-        "❌ Операция отменена.\n\nЧто хотите сделать дальше?",
-        parse_mode="HTML"
-    )
-    
-    # Удаляем старое сообщение
-    try:
-        await callback_query.message.delete()
-    except Exception as e:
-        logger.warning(f"Не удалось удалить сообщение: {e}")
+    # Редактируем сообщение с кнопками вместо пары "новое + удалить старое"
+    await _render_screen(callback_query, "❌ Операция отменена.\n\nЧто хотите сделать дальше?")
     
     # Подтверждаем обработку callback
     await callback_query.answer()
@@ -664,14 +961,20 @@ async def process_cancel(callback_query: CallbackQuery, state: FSMContext):
 # Обработка ввода лимита калорий
 async def process_calorie_limit(message: Message, state: FSMContext):
     """Process calorie limit setting"""
+    # Дешевая проверка вместо исключения: невалидный ввод не строит
+    # ValueError с трейсбеком, а длина ограничена до вызова int()
+    match = _LIMIT_RE.fullmatch((message.text or "").strip())
+    if not match:
+        await message.answer(
+            "❌ Пожалуйста, введите корректное число для лимита калорий (целое положительное число)."
+        )
+        return
+
+    limit = int(match.group())
     try:
-        limit = int(message.text.strip())
-        if limit <= 0:
-            raise ValueError("Limit must be positive")
-        
         user_id = message.from_user.id
-        user_data = get_user_data(user_id)
-        user_data.set_calorie_limit(limit)
+        user_data = await _get_user_data(user_id)
+        await asyncio.to_thread(user_data.set_calorie_limit, limit)
         
         await message.answer(
             f"✅ Ваш дневной лимит калорий установлен: <b>{limit} ккал</b>",
@@ -682,21 +985,22 @@ async def process_calorie_limit(message: Message, state: FSMContext):
         await show_settings(message)
         await state.clear()
         
-    except ValueError:
+    except Exception as e:
+        logger.error(f"Ошибка при установке лимита калорий: {e}")
         await message.answer(
-            "❌ Пожалуйста, введите корректное число для лимита калорий (целое положительное число)."
+            "❌ Не удалось сохранить лимит калорий. Попробуйте еще раз."
         )
 
 # Обработка нажатия на дату в сводке питания
 async def process_date_callback(callback_query: CallbackQuery):
     """Process date navigation in stats"""
     # Получаем дату из callback_data
-    data_parts = callback_query.data.split(":")
-    if len(data_parts) != 2:
+    # partition вместо split: один проход по строке без списка
+    _, sep, date_str = callback_query.data.partition(":")
+    if not sep:
         await callback_query.answer("Ошибка в формате даты")
         return
     
-    date_str = data_parts[1]
     logger.debug("Получена дата: %s", date_str)
     target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
     
@@ -707,59 +1011,34 @@ async def process_date_callback(callback_query: CallbackQuery):
 async def show_all_nutrients(callback_query: CallbackQuery):
     """Show all nutrients details"""
     user_id = callback_query.from_user.id
-    user_data = get_user_data(user_id)
+    user_data = await _get_user_data(user_id)
     
-    # Пытаемся получить дату из текста сообщения
-    message_text = callback_query.message.text
-    try:
-        # Ищем дату в формате DD.MM.YYYY в тексте сообщения
-        import re
-        date_match = re.search(r'(\d{2})\.(\d{2})\.(\d{4})', message_text)
-        if date_match:
-            day, month, year = map(int, date_match.groups())
-            current_date = date(year, month, day)
-        else:
-            current_date = user_data.get_current_date()
-    except Exception:
-        current_date = user_data.get_current_date()
+    # Дата зашита в callback_data кнопки; разбор текста сообщения
+    # остается запасным путем для старых клавиатур без даты
+    _, sep, payload = callback_query.data.partition(":")
+    current_date = None
+    if sep:
+        try:
+            current_date = datetime.strptime(payload, "%Y-%m-%d").date()
+        except ValueError:
+            pass
+    if current_date is None:
+        current_date = _parse_date_from_text(callback_query.message.text) or user_data.get_current_date()
     
     # Получаем статистику за день
-    stats = user_data.get_stats_by_date(current_date)
-    
-    # Получаем целевые значения всех нутриентов
-    protein_target = stats.get('protein_limit', 75) or 75
-    fat_target = stats.get('fat_limit', 60) or 60
-    carbs_target = stats.get('carbs_limit', 250) or 250
-    fiber_target = stats.get('fiber_limit', 30) or 30
-    sugar_target = stats.get('sugar_limit', 50) or 50
-    sodium_target = stats.get('sodium_limit', 2300) or 2300
-    cholesterol_target = stats.get('cholesterol_limit', 300) or 300
-    
-    # Создаем прогресс-бары для всех нутриентов
-    calorie_bar = user_data.generate_calorie_progress_bar(stats["calorie_percentage"])
-    protein_bar = user_data.generate_nutrient_progress_bar(stats["protein"], protein_target, "protein")
-    fat_bar = user_data.generate_nutrient_progress_bar(stats["fat"], fat_target, "fat")
-    carbs_bar = user_data.generate_nutrient_progress_bar(stats["carbs"], carbs_target, "carbs")
-    fiber_bar = user_data.generate_nutrient_progress_bar(stats.get("fiber", 0), fiber_target, "fiber")
-    sugar_bar = user_data.generate_nutrient_progress_bar(stats.get("sugar", 0), sugar_target, "sugar")
-    sodium_bar = user_data.generate_nutrient_progress_bar(stats.get("sodium", 0), sodium_target, "sodium")
-    cholesterol_bar = user_data.generate_nutrient_progress_bar(stats.get("cholesterol", 0), cholesterol_target, "cholesterol")
+    stats = await asyncio.to_thread(user_data.get_stats_by_date, current_date)
     
     # Формируем текст с информацией обо всех нутриентах
+    calorie_bar = user_data.generate_calorie_progress_bar(stats["calorie_percentage"])
     nutrients_text = (
         f"📊 <b>Детальная сводка питания за {stats['date']}</b>\n\n"
         f"Приёмов пищи: {stats['entries']}\n"
         f"Калории: {stats['calories']}/{stats.get('calorie_limit', '—')} ккал\n"
         f"{calorie_bar}\n\n"
         f"<b>Макронутриенты:</b>\n"
-        f"🥩 Белки: {stats['protein']}/{protein_target}г\n{protein_bar}\n"
-        f"🧈 Жиры: {stats['fat']}/{fat_target}г\n{fat_bar}\n"
-        f"🍚 Углеводы: {stats['carbs']}/{carbs_target}г\n{carbs_bar}\n\n"
-        f"<b>Дополнительные нутриенты:</b>\n"
-        f"🌱 Клетчатка: {stats.get('fiber', 0)}/{fiber_target}г\n{fiber_bar}\n"
-        f"🟣 Сахар: {stats.get('sugar', 0)}/{sugar_target}г\n{sugar_bar}\n"
-        f"⚪ Натрий: {stats.get('sodium', 0)}/{sodium_target}мг\n{sodium_bar}\n"
-        f"🔴 Холестерин: {stats.get('cholesterol', 0)}/{cholesterol_target}мг\n{cholesterol_bar}\n"
+        + _render_nutrient_lines(user_data, stats, ("protein", "fat", "carbs"))
+        + "\n<b>Дополнительные нутриенты:</b>\n"
+        + _render_nutrient_lines(user_data, stats, ("fiber", "sugar", "sodium", "cholesterol"))
     )
     
     # Импортируем клавиатуру для всех нутриентов
@@ -792,17 +1071,7 @@ async def process_refresh_stats(callback_query: CallbackQuery):
     # Используем ту же дату, что отображается сейчас
     # Получаем ее из текста сообщения
     message_text = callback_query.message.text
-    try:
-        # Ищем дату в формате DD.MM.YYYY в тексте сообщения
-        import re
-        date_match = re.search(r'(\d{2})\.(\d{2})\.(\d{4})', message_text)
-        if date_match:
-            day, month, year = map(int, date_match.groups())
-            current_date = date(year, month, day)
-        else:
-            current_date = date.today()
-    except:
-        current_date = date.today()
+    current_date = _parse_date_from_text(message_text) or date.today()
     
     # Показываем статистику за выбранную дату
     await show_stats(callback_query=callback_query, current_date=current_date, edit_message=True)
@@ -811,37 +1080,27 @@ async def process_refresh_stats(callback_query: CallbackQuery):
 async def process_meal_info(callback_query: CallbackQuery):
     """Show meal details"""
     # Получаем индекс приема пищи из callback_data
-    data_parts = callback_query.data.split(":")
-    if len(data_parts) != 2:
+    _, sep, payload = callback_query.data.partition(":")
+    if not sep:
         await callback_query.answer("Ошибка в формате данных")
         return
     
     try:
-        meal_index = int(data_parts[1])
+        meal_index = int(payload)
     except ValueError:
         await callback_query.answer("Некорректный индекс приема пищи")
         return
     
     # Получаем данные пользователя
     user_id = callback_query.from_user.id
-    user_data = get_user_data(user_id)
+    user_data = await _get_user_data(user_id)
     
     # Получаем текущую дату из текста сообщения
     message_text = callback_query.message.text
-    try:
-        # Ищем дату в формате DD.MM.YYYY в тексте сообщения
-        import re
-        date_match = re.search(r'(\d{2})\.(\d{2})\.(\d{4})', message_text)
-        if date_match:
-            day, month, year = map(int, date_match.groups())
-            current_date = date(year, month, day)
-        else:
-            current_date = date.today()
-    except:
-        current_date = date.today()
+    current_date = _parse_date_from_text(message_text) or date.today()
     
     # Получаем список приемов пищи за эту дату
-    meals = user_data.get_entries_by_date(current_date)
+    meals = await asyncio.to_thread(user_data.get_entries_by_date, current_date)
     
     if meal_index >= len(meals):
         await callback_query.answer("Прием пищи не найден")
@@ -877,7 +1136,8 @@ async def process_meal_info(callback_query: CallbackQuery):
         meal_text += "\n\n<b>Дополнительные нутриенты:</b>\n" + "\n".join(additional_nutrients)
     
     # Добавляем информацию о времени
-    meal_text += f"\n\n⏱ Время: {datetime.fromisoformat(meal['timestamp']).strftime('%H:%M:%S')}"
+    meal_time = meal.get("time") or datetime.fromisoformat(meal["timestamp"]).strftime("%H:%M:%S")
+    meal_text += f"\n\n⏱ Время: {meal_time}"
     
     # Отправляем детали с клавиатурой для удаления
     try:
@@ -903,30 +1163,20 @@ async def process_meal_info(callback_query: CallbackQuery):
 async def process_meals_page(callback_query: CallbackQuery):
     """Navigate through meals pages"""
     # Получаем номер страницы из callback_data
-    data_parts = callback_query.data.split(":")
-    if len(data_parts) != 2:
+    _, sep, payload = callback_query.data.partition(":")
+    if not sep:
         await callback_query.answer("Ошибка в формате данных")
         return
     
     try:
-        page = int(data_parts[1])
+        page = int(payload)
     except ValueError:
         await callback_query.answer("Некорректный номер страницы")
         return
     
     # Получаем текущую дату из текста сообщения
     message_text = callback_query.message.text
-    try:
-        # Ищем дату в формате DD.MM.YYYY в тексте сообщения
-        import re
-        date_match = re.search(r'(\d{2})\.(\d{2})\.(\d{4})', message_text)
-        if date_match:
-            day, month, year = map(int, date_match.groups())
-            current_date = date(year, month, day)
-        else:
-            current_date = date.today()
-    except:
-        current_date = date.today()
+    current_date = _parse_date_from_text(message_text) or date.today()
     
     # Показываем список приемов пищи с новой страницей
     await show_meals(
@@ -939,35 +1189,34 @@ async def process_meals_page(callback_query: CallbackQuery):
 # Обработка удаления приема пищи
 async def process_delete_meal(callback_query: CallbackQuery):
     """Delete meal entry"""
+    if not _first_delivery(callback_query):
+        await callback_query.answer("Уже обработано")
+        return
+    
     # Получаем индекс приема пищи из callback_data
-    data_parts = callback_query.data.split(":")
-    if len(data_parts) != 2:
+    _, sep, payload = callback_query.data.partition(":")
+    if not sep:
         await callback_query.answer("Ошибка в формате данных")
         return
     
     try:
-        meal_index = int(data_parts[1])
+        meal_index = int(payload)
     except ValueError:
         await callback_query.answer("Некорректный индекс приема пищи")
         return
     
     # Получаем данные пользователя
     user_id = callback_query.from_user.id
-    user_data = get_user_data(user_id)
+    user_data = await _get_user_data(user_id)
     
     # Получаем текущую дату из текста сообщения с деталями
     meal_name = "запись о еде"
-    try:
-        # Извлекаем название блюда из текста сообщения
-        import re
-        meal_match = re.search(r'🍽 <b>(.*?)</b>', callback_query.message.text)
-        if meal_match:
-            meal_name = meal_match.group(1)
-    except:
-        pass
+    meal_match = _MEAL_RE.search(callback_query.message.text or "")
+    if meal_match:
+        meal_name = meal_match.group(1)
     
     # Удаляем прием пищи
-    success = user_data.delete_entry_by_index(meal_index)
+    success = await asyncio.to_thread(user_data.delete_entry_by_index, meal_index)
     
     if success:
         # Сообщаем об удалении и показываем меню
@@ -1001,17 +1250,7 @@ async def process_refresh_meals(callback_query: CallbackQuery):
     """Refresh meals list"""
     # Получаем текущую дату из текста сообщения
     message_text = callback_query.message.text
-    try:
-        # Ищем дату в формате DD.MM.YYYY в тексте сообщения
-        import re
-        date_match = re.search(r'(\d{2})\.(\d{2})\.(\d{4})', message_text)
-        if date_match:
-            day, month, year = map(int, date_match.groups())
-            current_date = date(year, month, day)
-        else:
-            current_date = date.today()
-    except:
-        current_date = date.today()
+    current_date = _parse_date_from_text(message_text) or date.today()
     
     # Показываем обновленный список приемов пищи
     await show_meals(
@@ -1024,7 +1263,7 @@ async def process_refresh_meals(callback_query: CallbackQuery):
 async def show_timezone_selection(callback_query: CallbackQuery, state: FSMContext):
     """Show timezone selection screen"""
     user_id = callback_query.from_user.id
-    user_data = get_user_data(user_id)
+    user_data = await _get_user_data(user_id)
     current_timezone = user_data.timezone_code
     
     timezone_text = (
@@ -1036,14 +1275,8 @@ async def show_timezone_selection(callback_query: CallbackQuery, state: FSMConte
     # Создаем клавиатуру с выбором часовых поясов
     keyboard = get_timezone_keyboard(current_timezone)
     
-    # Отправляем новое сообщение вместо редактирования
-    await callback_query.message.answer(timezone_text, parse_mode="HTML", reply_markup=keyboard)
-    
-    # Удаляем старое сообщение
-    try:
-        await callback_query.message.delete()
-    except Exception as e:
-        logger.warning(f"Не удалось удалить сообщение: {e}")
+    # Отправка нового сообщения и удаление старого идут параллельно
+    await _answer_and_delete(callback_query, timezone_text, keyboard)
     
     await state.set_state(CalorieTrackerStates.waiting_for_timezone)
     await callback_query.answer()
@@ -1052,20 +1285,20 @@ async def show_timezone_selection(callback_query: CallbackQuery, state: FSMConte
 async def process_timezone_page(callback_query: CallbackQuery, state: FSMContext):
     """Navigate through timezone pages"""
     # Получаем номер страницы из callback_data
-    data_parts = callback_query.data.split(":")
-    if len(data_parts) != 2:
+    _, sep, payload = callback_query.data.partition(":")
+    if not sep:
         await callback_query.answer("Ошибка в формате данных")
         return
     
     try:
-        page = int(data_parts[1])
+        page = int(payload)
     except ValueError:
         await callback_query.answer("Некорректный номер страницы")
         return
     
     # Получаем текущий часовой пояс пользователя
     user_id = callback_query.from_user.id
-    user_data = get_user_data(user_id)
+    user_data = await _get_user_data(user_id)
     current_timezone = user_data.timezone_code
     
     # Обновляем клавиатуру с часовыми поясами
@@ -1092,38 +1325,30 @@ async def process_timezone_page(callback_query: CallbackQuery, state: FSMContext
 async def set_selected_timezone(callback_query: CallbackQuery, state: FSMContext):
     """Set selected timezone for user"""
     # Получаем выбранный часовой пояс из callback_data
-    data_parts = callback_query.data.split(":")
-    if len(data_parts) != 2:
+    _, sep, timezone_code = callback_query.data.partition(":")
+    if not sep:
         await callback_query.answer("Ошибка в формате данных")
         return
     
-    timezone_code = data_parts[1]
-    
     # Получаем данные пользователя
     user_id = callback_query.from_user.id
-    user_data = get_user_data(user_id)
+    user_data = await _get_user_data(user_id)
     
     # Устанавливаем новый часовой пояс
-    success = user_data.set_timezone(timezone_code)
+    success = await asyncio.to_thread(user_data.set_timezone, timezone_code)
     
     if success:
-        # Отправляем новое сообщение
-        await callback_query.message.answer(
+        # Подтверждение и удаление старого сообщения идут параллельно
+        await _answer_and_delete(
+            callback_query,
             f"✅ Часовой пояс успешно установлен: <b>{timezone_code}</b>",
-            parse_mode="HTML"
         )
         
-        # Удаляем старое сообщение
-        try:
-            await callback_query.message.delete()
-        except Exception as e:
-            logger.warning(f"Не удалось удалить сообщение: {e}")
-        
         # Сообщаем об успешной установке во всплывающем уведомлении
         await callback_query.answer(f"Часовой пояс установлен")
         
-        # Возвращаемся в настройки
-        await show_settings(callback_query=callback_query)
+        # Возвращаемся в настройки; user_data уже в руках — не ищем повторно
+        await show_settings(callback_query=callback_query, user_data=user_data)
         await state.clear()
     else:
         await callback_query.answer("Ошибка: недопустимый часовой пояс")
@@ -1133,39 +1358,19 @@ async def back_to_settings(callback_query: CallbackQuery, state: FSMContext):
     """Return from timezone selection to settings"""
     await state.clear()
     
-    # Отправляем новое сообщение вместо редактирования
-    await callback_query.message.answer("Возвращаемся в настройки...")
-    
-    # Удаляем старое сообщение
-    try:
-        await callback_query.message.delete()
-    except Exception as e:
-        logger.warning(f"Не удалось удалить сообщение: {e}")
-    
-    # Показываем меню настроек
+    # Показываем меню настроек: show_settings редактирует текущее
+    # сообщение на месте, так что промежуточное "Возвращаемся..." и
+    # удаление старого сообщения больше не нужны
     await show_settings(callback_query=callback_query)
     
 # Функция для выбора формата установки КБЖУ
 async def show_kbju_format_selection(callback_query: CallbackQuery, state: FSMContext):
     """Show KBJU format selection screen"""
-    format_text = (
-        f"📊 <b>Настройка лимитов КБЖУ</b>\n\n"
-        f"Выберите способ установки лимитов белков, жиров и углеводов:\n\n"
-        f"<b>✍️ Ввести вручную</b> - установить каждое значение отдельно\n"
-        f"<b>🧮 Рассчитать по весу</b> - расчёт на основе вашего веса и % жира в теле"
-    )
-    
     # Создаем клавиатуру с выбором формата
     keyboard = get_kbju_format_keyboard()
     
-    # Отправляем новое сообщение вместо редактирования
-    await callback_query.message.answer(format_text, parse_mode="HTML", reply_markup=keyboard)
-    
-    # Удаляем старое сообщение
-    try:
-        await callback_query.message.delete()
-    except Exception as e:
-        logger.warning(f"Не удалось удалить сообщение: {e}")
+    # Отправляем новый экран вместо редактирования, старый удаляем параллельно
+    await _answer_and_delete(callback_query, _KBJU_FORMAT_TEXT, keyboard)
     
     await state.set_state(CalorieTrackerStates.waiting_for_kbju_format)
     await callback_query.answer()
@@ -1174,7 +1379,7 @@ async def show_kbju_format_selection(callback_query: CallbackQuery, state: FSMCo
 async def set_manual_kbju(callback_query: CallbackQuery, state: FSMContext):
     """Start manual KBJU limits setting"""
     user_id = callback_query.from_user.id
-    user_data = get_user_data(user_id)
+    user_data = await _get_user_data(user_id)
     
     # Получаем текущие значения
     protein_limit = user_data.protein_limit
@@ -1185,14 +1390,8 @@ async def set_manual_kbju(callback_query: CallbackQuery, state: FSMContext):
         f"Введите новый дневной лимит белков в граммах:"
     )
     
-    # Отправляем новое сообщение
-    await callback_query.message.answer(protein_text, parse_mode="HTML")
-    
-    # Удаляем старое сообщение
-    try:
-        await callback_query.message.delete()
-    except Exception as e:
-        logger.warning(f"Не удалось удалить сообщение: {e}")
+    # Отправка подсказки и удаление старого сообщения идут параллельно
+    await _answer_and_delete(callback_query, protein_text)
     
     await state.set_state(CalorieTrackerStates.waiting_for_protein_limit)
     await callback_query.answer()
@@ -1209,12 +1408,7 @@ async def process_protein_limit(message: Message, state: FSMContext):
         await state.update_data(protein_limit=protein)
         
         # Запрашиваем лимит жиров
-        fat_text = (
-            f"🧈 <b>Установка лимита жиров</b>\n\n"
-            f"Введите дневной лимит жиров в граммах:"
-        )
-        
-        await message.answer(fat_text, parse_mode="HTML")
+        await message.answer(_FAT_LIMIT_PROMPT, parse_mode="HTML")
         await state.set_state(CalorieTrackerStates.waiting_for_fat_limit)
         
     except ValueError:
@@ -1235,12 +1429,7 @@ async def process_fat_limit(message: Message, state: FSMContext):
         await state.update_data(fat_limit=fat)
         
         # Запрашиваем лимит углеводов
-        carbs_text = (
-            f"🍚 <b>Установка лимита углеводов</b>\n\n"
-            f"Введите дневной лимит углеводов в граммах:"
-        )
-        
-        await message.answer(carbs_text, parse_mode="HTML")
+        await message.answer(_CARBS_LIMIT_PROMPT, parse_mode="HTML")
         await state.set_state(CalorieTrackerStates.waiting_for_carbs_limit)
         
     except ValueError:
@@ -1260,13 +1449,7 @@ async def process_carbs_limit(message: Message, state: FSMContext):
         await state.update_data(carbs_limit=carbs)
         
         # Запрашиваем лимит клетчатки (опционально)
-        fiber_text = (
-            f"🌱 <b>Установка лимита клетчатки</b>\n\n"
-            f"Введите дневной лимит клетчатки в граммах:\n"
-            f"(это необязательный параметр, введите 0, если не хотите устанавливать лимит)"
-        )
-        
-        await message.answer(fiber_text, parse_mode="HTML")
+        await message.answer(_FIBER_LIMIT_PROMPT, parse_mode="HTML")
         await state.set_state(CalorieTrackerStates.waiting_for_fiber_limit)
         
     except ValueError:
@@ -1375,9 +1558,10 @@ async def process_cholesterol_limit(message: Message, state: FSMContext):
         
         # Устанавливаем лимиты КБЖУ и дополнительных нутриентов
         user_id = message.from_user.id
-        user_data = get_user_data(user_id)
+        user_data = await _get_user_data(user_id)
         
-        success = user_data.set_macros_limits(
+        success = await asyncio.to_thread(
+            user_data.set_macros_limits,
             protein=protein,
             fat=fat,
             carbs=carbs,
@@ -1444,30 +1628,24 @@ async def process_cholesterol_limit(message: Message, state: FSMContext):
 # Функция для установки рассчитанного лимита калорий из КБЖУ
 async def set_calculated_calories(callback_query: CallbackQuery):
     """Set calculated calories from KBJU"""
-    data_parts = callback_query.data.split(":")
-    if len(data_parts) != 2:
+    _, sep, payload = callback_query.data.partition(":")
+    if not sep:
         await callback_query.answer("Ошибка в формате данных")
         return
     
     try:
-        calories = int(float(data_parts[1]))
+        calories = int(float(payload))
         
         user_id = callback_query.from_user.id
-        user_data = get_user_data(user_id)
-        user_data.set_calorie_limit(calories)
+        user_data = await _get_user_data(user_id)
+        await asyncio.to_thread(user_data.set_calorie_limit, calories)
         
-        # Отправляем сообщение об успешной установке
-        await callback_query.message.answer(
+        # Подтверждение и удаление старого сообщения идут параллельно
+        await _answer_and_delete(
+            callback_query,
             f"✅ Лимит калорий установлен: <b>{calories} ккал</b>",
-            parse_mode="HTML"
         )
         
-        # Удаляем старое сообщение
-        try:
-            await callback_query.message.delete()
-        except Exception as e:
-            logger.warning(f"Не удалось удалить сообщение: {e}")
-        
         await callback_query.answer()
         await show_settings(callback_query=callback_query)
         
@@ -1479,7 +1657,7 @@ async def set_calculated_calories(callback_query: CallbackQuery):
 async def set_body_metrics(callback_query: CallbackQuery, state: FSMContext):
     """Start body metrics input process"""
     user_id = callback_query.from_user.id
-    user_data = get_user_data(user_id)
+    user_data = await _get_user_data(user_id)
     
     # Получаем текущие значения
     weight = user_data.user_weight
@@ -1490,14 +1668,8 @@ async def set_body_metrics(callback_query: CallbackQuery, state: FSMContext):
         f"Введите ваш вес в килограммах:"
     )
     
-    # Отправляем новое сообщение
-    await callback_query.message.answer(weight_text, parse_mode="HTML")
-    
-    # Удаляем старое сообщение
-    try:
-        await callback_query.message.delete()
-    except Exception as e:
-        logger.warning(f"Не удалось удалить сообщение: {e}")
+    # Отправка подсказки и удаление старого сообщения идут параллельно
+    await _answer_and_delete(callback_query, weight_text)
     
     await state.set_state(CalorieTrackerStates.waiting_for_weight)
     await callback_query.answer()
@@ -1514,16 +1686,7 @@ async def process_weight(message: Message, state: FSMContext):
         await state.update_data(weight=weight)
         
         # Запрашиваем процент жира
-        fat_text = (
-            f"📏 <b>Установка процента жира в теле</b>\n\n"
-            f"Введите процент жира в теле (число от 5 до 50):\n"
-            f"Примерные значения:\n"
-            f"- Мужчины: 10-25%\n"
-            f"- Женщины: 18-30%\n"
-            f"Если вы не знаете свой процент жира, введите примерное значение:"
-        )
-        
-        await message.answer(fat_text, parse_mode="HTML")
+        await message.answer(_BODY_FAT_PROMPT, parse_mode="HTML")
         await state.set_state(CalorieTrackerStates.waiting_for_body_fat)
         
     except ValueError:
@@ -1552,13 +1715,13 @@ async def process_body_fat(message: Message, state: FSMContext):
         
         # Устанавливаем метрики тела и рассчитываем рекомендуемые КБЖУ
         user_id = message.from_user.id
-        user_data = get_user_data(user_id)
+        user_data = await _get_user_data(user_id)
         
-        success = user_data.set_user_body_metrics(weight=weight, body_fat=body_fat)
+        success = await asyncio.to_thread(user_data.set_user_body_metrics, weight=weight, body_fat=body_fat)
         
         if success:
             # Получаем рассчитанные лимиты
-            today_stats = user_data.get_today_stats()
+            today_stats = await asyncio.to_thread(user_data.get_today_stats)
             protein_limit = today_stats.get('protein_limit', 0)
             fat_limit = today_stats.get('fat_limit', 0)
             carbs_limit = today_stats.get('carbs_limit', 0)
@@ -1598,7 +1761,92 @@ async def process_body_fat(message: Message, state: FSMContext):
         await state.clear()
         await show_settings(message)
 
+# Диспетчеризация callback_query: вместо двух с лишним десятков фильтров,
+# которые aiogram проверяет линейно на каждое нажатие, callback_data
+# разбирается по префиксу до ":" и обработчик находится одним поиском в dict
+_CB_TABLE = {
+    "show_stats": show_stats,
+    "back_to_main": show_stats,  # Перенаправляем к статистике вместо главного меню
+    "back_to_stats": show_stats,
+    "show_meals": show_meals,
+    "settings": show_settings,
+    "confirm": process_confirmation,
+    "cancel": process_cancel,
+    "date": process_date_callback,
+    "refresh_stats": process_refresh_stats,
+    "all_nutrients": show_all_nutrients,
+    "meal_info": process_meal_info,
+    "meals_page": process_meals_page,
+    "refresh_meals": process_refresh_meals,
+    "delete_meal": process_delete_meal,
+    "back_to_meals": process_back_to_meals,
+    "set_calorie_limit": set_calorie_limit,
+    "set_timezone": show_timezone_selection,
+    "timezone_page": process_timezone_page,
+    "timezone": set_selected_timezone,
+    "back_to_settings": back_to_settings,
+    "set_kbju": show_kbju_format_selection,
+    "kbju_manual": set_manual_kbju,
+    "kbju_calculate": set_body_metrics,
+    "set_body_metrics": set_body_metrics,
+    "set_calc_calories": set_calculated_calories,
+}
+
+def _cb_adapter(handler):
+    """Привести обработчик к единой сигнатуре (callback_query, state)
+
+    Сигнатуры различаются: экраны принимают message/callback_query как
+    именованные аргументы, часть обработчиков не использует state.
+    Разбор сигнатуры выполняется один раз при сборке таблицы.
+    """
+    params = inspect.signature(handler).parameters
+    if "message" in params:
+        async def call(callback_query, state):
+            await handler(callback_query=callback_query)
+    elif "state" in params:
+        async def call(callback_query, state):
+            await handler(callback_query, state)
+    else:
+        async def call(callback_query, state):
+            await handler(callback_query)
+    return call
+
+_CB_HANDLERS = {key: _cb_adapter(handler) for key, handler in _CB_TABLE.items()}
+
+async def _dispatch_callback(callback_query: CallbackQuery, state: FSMContext):
+    """Единая точка входа callback_query: поиск обработчика по префиксу"""
+    key = (callback_query.data or "").partition(":")[0]
+    handler = _CB_HANDLERS.get(key)
+    if handler is None:
+        # Неизвестная кнопка (например, из старого сообщения) — просто
+        # снимаем "часики" у пользователя
+        await callback_query.answer()
+        return
+    await handler(callback_query, state)
+
 # Регистрация обработчиков
+# Фильтры-константы: один и тот же объект фильтра переиспользуется
+# aiogram при проверке каждого входящего апдейта
+_BTN_STATS = F.text == "📊 Сводка питания"
+_BTN_MEALS = F.text == "🍽️ Приемы пищи"
+_BTN_SETTINGS = F.text == "⚙️ Настройки"
+_BTN_HELP = F.text == "ℹ️ Инструкция"
+_HAS_PHOTO = F.photo
+
+# Состояния ввода значений: пары (обработчик, фильтр состояния)
+_STATE_HANDLERS = (
+    (process_calorie_limit, StateFilter(CalorieTrackerStates.waiting_for_calorie_limit)),
+    (process_protein_limit, StateFilter(CalorieTrackerStates.waiting_for_protein_limit)),
+    (process_fat_limit, StateFilter(CalorieTrackerStates.waiting_for_fat_limit)),
+    (process_carbs_limit, StateFilter(CalorieTrackerStates.waiting_for_carbs_limit)),
+    (process_fiber_limit, StateFilter(CalorieTrackerStates.waiting_for_fiber_limit)),
+    (process_sugar_limit, StateFilter(CalorieTrackerStates.waiting_for_sugar_limit)),
+    (process_sodium_limit, StateFilter(CalorieTrackerStates.waiting_for_sodium_limit)),
+    (process_cholesterol_limit, StateFilter(CalorieTrackerStates.waiting_for_cholesterol_limit)),
+    (process_weight, StateFilter(CalorieTrackerStates.waiting_for_weight)),
+    (process_body_fat, StateFilter(CalorieTrackerStates.waiting_for_body_fat)),
+)
+
 def register_handlers(dp: Dispatcher):
     """Register all handlers"""
     # Create a router
@@ -1609,66 +1857,21 @@ def register_handlers(dp: Dispatcher):
     router.message.register(cmd_help, Command("help"))
     
     # Main menu button handlers (ReplyKeyboard)
-    router.message.register(show_stats, F.text == "📊 Сводка питания")
-    router.message.register(show_meals, F.text == "🍽️ Приемы пищи")
-    router.message.register(show_settings, F.text == "⚙️ Настройки")
-    router.message.register(cmd_help, F.text == "ℹ️ Инструкция")
+    router.message.register(show_stats, _BTN_STATS)
+    router.message.register(show_meals, _BTN_MEALS)
+    router.message.register(show_settings, _BTN_SETTINGS)
+    router.message.register(cmd_help, _BTN_HELP)
     
     # Photo handling - для любого состояния и без состояния
-    router.message.register(process_photo, F.photo)
+    router.message.register(process_photo, _HAS_PHOTO)
     
     # State handlers
-    router.message.register(process_calorie_limit, StateFilter(CalorieTrackerStates.waiting_for_calorie_limit))
-    router.message.register(process_protein_limit, StateFilter(CalorieTrackerStates.waiting_for_protein_limit))
-    router.message.register(process_fat_limit, StateFilter(CalorieTrackerStates.waiting_for_fat_limit))
-    router.message.register(process_carbs_limit, StateFilter(CalorieTrackerStates.waiting_for_carbs_limit))
-    router.message.register(process_fiber_limit, StateFilter(CalorieTrackerStates.waiting_for_fiber_limit))
-    router.message.register(process_sugar_limit, StateFilter(CalorieTrackerStates.waiting_for_sugar_limit))
-    router.message.register(process_sodium_limit, StateFilter(CalorieTrackerStates.waiting_for_sodium_limit))
-    router.message.register(process_cholesterol_limit, StateFilter(CalorieTrackerStates.waiting_for_cholesterol_limit))
-    router.message.register(process_weight, StateFilter(CalorieTrackerStates.waiting_for_weight))
-    router.message.register(process_body_fat, StateFilter(CalorieTrackerStates.waiting_for_body_fat))
-    
-    # Callback query handlers - main menu
-    router.callback_query.register(show_stats, F.data == "show_stats")
-    router.callback_query.register(show_stats, F.data == "back_to_main")  # Перенаправляем к статистике вместо главного меню
-    router.callback_query.register(show_meals, F.data == "show_meals")
-    router.callback_query.register(show_settings, F.data == "settings")
-    
-    # Callback query handlers - food confirmation
-    router.callback_query.register(process_confirmation, F.data == "confirm", StateFilter(CalorieTrackerStates.waiting_for_confirmation))
-    router.callback_query.register(process_cancel, F.data == "cancel")
-    
-    # Callback query handlers - stats navigation
-    router.callback_query.register(process_date_callback, F.data.startswith("date:"))
-    router.callback_query.register(process_refresh_stats, F.data == "refresh_stats")
-    router.callback_query.register(show_all_nutrients, F.data == "all_nutrients")
-    router.callback_query.register(show_stats, F.data == "back_to_stats")
-    
-    # Callback query handlers - meals list
-    router.callback_query.register(process_meal_info, F.data.startswith("meal_info:"))
-    router.callback_query.register(process_meals_page, F.data.startswith("meals_page:"))
-    router.callback_query.register(process_refresh_meals, F.data == "refresh_meals")
-    
-    # Callback query handlers - meal details
-    router.callback_query.register(process_delete_meal, F.data.startswith("delete_meal:"))
-    router.callback_query.register(process_back_to_meals, F.data == "back_to_meals")
-    
-    # Callback query handlers - settings
-    router.callback_query.register(set_calorie_limit, F.data == "set_calorie_limit")
-    router.callback_query.register(show_timezone_selection, F.data == "set_timezone")
-    
-    # Callback query handlers - timezone selection
-    router.callback_query.register(process_timezone_page, F.data.startswith("timezone_page:"))
-    router.callback_query.register(set_selected_timezone, F.data.startswith("timezone:"))
-    router.callback_query.register(back_to_settings, F.data == "back_to_settings")
-    
-    # Callback query handlers - KBJU format and settings
-    router.callback_query.register(show_kbju_format_selection, F.data == "set_kbju")
-    router.callback_query.register(set_manual_kbju, F.data == "kbju_manual")
-    router.callback_query.register(set_body_metrics, F.data == "kbju_calculate")
-    router.callback_query.register(set_body_metrics, F.data == "set_body_metrics")
-    router.callback_query.register(set_calculated_calories, F.data.startswith("set_calc_calories:"))
+    for handler, state_filter in _STATE_HANDLERS:
+        router.message.register(handler, state_filter)
+    
+    # Callback query handlers: единый диспетчер, маршрутизация по
+    # префиксу callback_data через _CB_TABLE
+    router.callback_query.register(_dispatch_callback)
     
     # Include the router in the dispatcher
     dp.include_router(router)
@@ -1,7 +1,12 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from datetime import date, timedelta, datetime
+from functools import lru_cache
 from bot.storage import AVAILABLE_TIMEZONES
 
+# Клавиатуры ниже никогда не мутируются после создания, поэтому готовые
+# объекты можно спокойно кэшировать и переиспользовать между отправками
+
+@lru_cache(maxsize=1)
 def get_main_keyboard():
     """Return the main keyboard with permanent functionality buttons"""
     kb = [
@@ -17,11 +22,15 @@ def get_main_keyboard():
     keyboard = ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True, persistent=True)
     return keyboard
 
-def get_confirm_keyboard():
-    """Return inline keyboard with confirm/cancel buttons"""
+def get_confirm_keyboard(token: str):
+    """Return inline keyboard with confirm/cancel buttons
+
+    Токен ссылается на сохраненный результат анализа, так что
+    подтверждение не зависит от FSM-состояния чата.
+    """
     kb = [
         [
-            InlineKeyboardButton(text="✅ Подтвердить", callback_data="confirm"),
+            InlineKeyboardButton(text="✅ Подтвердить", callback_data=f"confirm:{token}"),
             InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")
         ]
     ]
@@ -39,8 +48,12 @@ def get_stats_keyboard(current_date=None):
         #except ValueError:
         #    current_date = date.today()
     
-    # Получаем сегодняшнюю дату для сравнения
-    today = date.today()
+    # Раскладка зависит только от пары (дата, сегодня) — строим один раз
+    return _build_stats_keyboard(current_date, date.today())
+
+@lru_cache(maxsize=64)
+def _build_stats_keyboard(current_date, today):
+    """Собрать клавиатуру навигации по датам для пары (дата, сегодня)"""
     current_str = current_date.strftime("%d.%m.%Y")
     
     # Вычисляем границы для навигации: можно листать до 7 дней назад
@@ -81,22 +94,30 @@ def get_stats_keyboard(current_date=None):
     keyboard = InlineKeyboardMarkup(inline_keyboard=kb)
     return keyboard
 
-def get_meals_keyboard(meals, page=0, page_size=5):
-    """Return inline keyboard with meal list and pagination"""
+def get_meals_keyboard(meals, page=0, page_size=5, total=None):
+    """Return inline keyboard with meal list and pagination
+
+    Если передан total, meals — это уже готовая страница из SQL-запроса;
+    иначе meals — полный список за день и страница вырезается здесь.
+    """
     kb = []
     
     # Добавляем кнопки для каждого приема пищи на текущей странице
     start_idx = page * page_size
-    end_idx = min(start_idx + page_size, len(meals))
-    
-    for i in range(start_idx, end_idx):
-        meal = meals[i]
+    if total is None:
+        total = len(meals)
+        page_meals = meals[start_idx:start_idx + page_size]
+    else:
+        page_meals = meals
+    end_idx = start_idx + len(page_meals)
+    
+    for offset, meal in enumerate(page_meals):
         meal_name = meal["food_name"]
         meal_calories = meal["calories"]
         kb.append([
             InlineKeyboardButton(
                 text=f"{meal_name} ({meal_calories} ккал)",
-                callback_data=f"meal_info:{i}"
+                callback_data=f"meal_info:{start_idx + offset}"
             )
         ])
     
@@ -105,7 +126,7 @@ def get_meals_keyboard(meals, page=0, page_size=5):
     if page > 0:
         nav_buttons.append(InlineKeyboardButton(text="◀️ Пред.", callback_data=f"meals_page:{page-1}"))
     
-    if end_idx < len(meals):
+    if end_idx < total:
         nav_buttons.append(InlineKeyboardButton(text="След. ▶️", callback_data=f"meals_page:{page+1}"))
     
     if nav_buttons:
@@ -128,6 +149,7 @@ def get_meal_detail_keyboard(meal_index):
     keyboard = InlineKeyboardMarkup(inline_keyboard=kb)
     return keyboard
 
+@lru_cache(maxsize=1)
 def get_settings_keyboard():
     """Return inline keyboard for settings"""
     kb = [
@@ -147,8 +169,13 @@ def get_settings_keyboard():
     keyboard = InlineKeyboardMarkup(inline_keyboard=kb)
     return keyboard
 
+@lru_cache(maxsize=64)
 def get_timezone_keyboard(current_timezone="МСК", page=0):
-    """Return inline keyboard with timezone options"""
+    """Return inline keyboard with timezone options
+
+    Чистая функция от (текущий пояс, страница) над статичным списком
+    AVAILABLE_TIMEZONES — листание страниц переиспользует готовые объекты.
+    """
     # Разбиваем часовые пояса на страницы
     page_size = 7
     timezone_items = list(AVAILABLE_TIMEZONES.items())
@@ -190,6 +217,7 @@ def get_timezone_keyboard(current_timezone="МСК", page=0):
 
 # Функция get_main_menu_inline_keyboard удалена по запросу пользователя
 
+@lru_cache(maxsize=1)
 def get_kbju_format_keyboard():
     """Return keyboard with format selection for KBJU limits"""
     kb = [
@@ -209,10 +237,16 @@ def get_kbju_format_keyboard():
 def get_improved_stats_keyboard(stats, width=8):
     """Return inline keyboard for improved stats display with all nutrients"""
     
-    # Кнопки для перехода к подробной статистике по нутриентам
+    # Кнопки для перехода к подробной статистике по нутриентам.
+    # Дата зашивается в callback_data, чтобы обработчику не пришлось
+    # выпарсивать её из текста сообщения
+    current = stats.get("date")
+    if isinstance(current, str):
+        current = datetime.strptime(current, "%d.%m.%Y").date()
+    iso_date = (current or date.today()).strftime("%Y-%m-%d")
     kb = [
         [
-            InlineKeyboardButton(text="📊 Все нутриенты", callback_data="all_nutrients")
+            InlineKeyboardButton(text="📊 Все нутриенты", callback_data=f"all_nutrients:{iso_date}")
         ]
     ]
     
@@ -241,6 +275,7 @@ def get_all_nutrients_keyboard(stats):
     
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
+@lru_cache(maxsize=1)
 def get_macros_settings_keyboard():
     """Return keyboard for macros settings with additional nutrients"""
     kb = [
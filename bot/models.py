@@ -1,9 +1,10 @@
 import os
+from contextlib import contextmanager
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, create_engine
-from sqlalchemy.orm import relationship, sessionmaker, Session
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index, create_engine
+from sqlalchemy.orm import relationship, sessionmaker, scoped_session, Session
 from sqlalchemy.ext.declarative import declarative_base
 
 from dotenv import load_dotenv
@@ -44,6 +45,12 @@ class User(Base):
 class FoodEntry(Base):
     __tablename__ = "food_entries"
     
+    # Составной индекс для выборок "записи пользователя за период" —
+    # превращает фильтр user_id + timestamp и ORDER BY timestamp в range scan
+    __table_args__ = (
+        Index("ix_food_entries_user_ts", "user_id", "timestamp"),
+    )
+    
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     food_name = Column(String, nullable=False)
@@ -79,20 +86,46 @@ class FoodEntry(Base):
             "timestamp": self.timestamp.isoformat()
         }
 
-# Создаем подключение к базе данных
-engine = create_engine(DATABASE_URL, echo=False)
+# Создаем подключение к базе данных.
+# Размер пула подобран под количество одновременных обработчиков бота:
+# соединения переиспользуются вместо открытия нового на каждый запрос.
+# pool_pre_ping отсекает умершие соединения до выполнения запроса,
+# pool_recycle обновляет их раньше, чем их закроет сервер/балансировщик.
+engine = create_engine(
+    DATABASE_URL,
+    echo=False,
+    pool_size=20,
+    max_overflow=10,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+)
 
 # Создаем все таблицы в базе данных
 def init_db():
     Base.metadata.create_all(engine)
+    # Доводим индекс на уже существующих базах: create_all не добавляет
+    # индексы к таблицам, которые уже были созданы
+    for index in FoodEntry.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
 
-# Создаем фабрику сессий
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Создаем фабрику сессий; scoped_session переиспользует сессию в рамках
+# одного потока вместо создания новой на каждый вызов
+SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
 
 # Функция для получения сессии
 def get_db() -> Session:
+    return SessionLocal()
+
+# Контекстный менеджер сессии: гарантированный commit/rollback
+# и возврат соединения в пул без ручных try/finally у вызывающих
+@contextmanager
+def session_scope():
     db = SessionLocal()
     try:
-        return db
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
     finally:
         db.close()
\ No newline at end of file
@@ -1,8 +1,26 @@
 import os
 import json
 import logging
+
+try:
+    # Быстрый парсер JSON для ответов модели; stdlib остается запасным
+    import orjson
+except ImportError:
+    orjson = None
 import asyncio
-from openai import AsyncOpenAI
+import base64
+import hashlib
+from collections import OrderedDict
+from time import monotonic
+from typing import Union
+
+try:
+    # SIMD-ускоренный base64: заметно быстрее stdlib на мегабайтных фото
+    import pybase64
+except ImportError:
+    pybase64 = None
+
+from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, RateLimitError
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -15,12 +33,75 @@ if not OPENAI_API_KEY:
 # Initialize the OpenAI client
 client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
-async def analyze_food_image(base64_image: str) -> dict:
+# Ограничиваем одновременные запросы к OpenAI: всплеск фотографий не
+# должен превращаться в пачку 429-х. Размер окна настраивается под
+# фактический rate limit аккаунта без правки кода
+_openai_semaphore = asyncio.Semaphore(int(os.environ.get("OPENAI_CONCURRENCY", "5")))
+
+# Параметры ретраев при троттлинге/сетевых сбоях
+_MAX_ATTEMPTS = 3
+_BASE_RETRY_DELAY = 1.0  # секунды, удваивается с каждой попыткой
+_MAX_RETRY_DELAY = 10.0
+
+async def _create_with_retry(**kwargs):
+    """Вызвать chat.completions.create с экспоненциальным бэкоффом.
+
+    Повторяются только временные ошибки (429, таймауты, обрывы
+    соединения); остальные исключения уходят вызывающему сразу.
+    """
+    delay = _BASE_RETRY_DELAY
+    for attempt in range(_MAX_ATTEMPTS):
+        try:
+            return await client.chat.completions.create(**kwargs)
+        except (RateLimitError, APIConnectionError, APITimeoutError) as e:
+            if attempt == _MAX_ATTEMPTS - 1:
+                raise
+            logger.warning(
+                f"OpenAI временно недоступен (попытка {attempt + 1}/{_MAX_ATTEMPTS}): {e}"
+            )
+            await asyncio.sleep(min(_MAX_RETRY_DELAY, delay))
+            delay *= 2
+
+# Кэш результатов анализа по хэшу байтов фото: повторная отправка того же
+# изображения (ретраи, типовые фото) не ходит в OpenAI вообще
+_ANALYSIS_CACHE_MAXSIZE = 2048
+_ANALYSIS_CACHE_TTL = 86400  # сутки
+_analysis_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+def _cache_get(key: str):
+    """Достать результат анализа из кэша, если он не устарел"""
+    cached = _analysis_cache.get(key)
+    if cached is None:
+        return None
+    saved_at, result = cached
+    if monotonic() - saved_at > _ANALYSIS_CACHE_TTL:
+        del _analysis_cache[key]
+        return None
+    _analysis_cache.move_to_end(key)
+    return result
+
+def _cache_put(key: str, result: dict) -> None:
+    """Сохранить результат анализа, вытесняя самый старый при переполнении"""
+    _analysis_cache[key] = (monotonic(), result)
+    _analysis_cache.move_to_end(key)
+    if len(_analysis_cache) > _ANALYSIS_CACHE_MAXSIZE:
+        _analysis_cache.popitem(last=False)
+
+def _encode_image(image_bytes) -> str:
+    """Закодировать байты изображения в base64-строку для data URI"""
+    if pybase64 is not None:
+        # b64encode_as_string сразу отдает str без промежуточных bytes;
+        # memoryview избавляет от копии, если пришел буфер BytesIO
+        return pybase64.b64encode_as_string(memoryview(image_bytes))
+    return base64.b64encode(image_bytes).decode("utf-8")
+
+async def analyze_food_image(image: Union[bytes, bytearray, memoryview, str]) -> dict:
     """
     Analyze food image using OpenAI Vision API
     
     Args:
-        base64_image: Base64 encoded image
+        image: Сырые байты изображения (кодируются здесь один раз)
+               или уже готовая base64-строка
         
     Returns:
         Dictionary with food analysis:
@@ -32,6 +113,23 @@ async def analyze_food_image(base64_image: str) -> dict:
             "carbs": float
         }
     """
+    # Chat API принимает изображения только как data URI, поэтому base64
+    # неизбежен — но кодируем один раз и без лишних буферов
+    cache_key = None
+    if not isinstance(image, str):
+        cache_key = hashlib.blake2b(image, digest_size=16).hexdigest()
+        cached = _cache_get(cache_key)
+        if cached is not None:
+            logger.debug("Результат анализа взят из кэша")
+            return cached
+
+    # Кодирование мегабайтного фото — заметная CPU-работа; уводим ее
+    # в поток, чтобы не блокировать event loop на время encode
+    if isinstance(image, str):
+        base64_image = image
+    else:
+        base64_image = await asyncio.to_thread(_encode_image, image)
+
     try:
         # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
         # do not change this unless explicitly requested by the user
@@ -71,36 +169,40 @@ async def analyze_food_image(base64_image: str) -> dict:
         Не включай в ответ ничего, кроме JSON. Если невозможно определить какой-то из нутриентов, используй значение 0.
         """
         
-        response = await client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                        }
-                    ]
-                }
-            ],
-            response_format={"type": "json_object"},
-            max_tokens=2000,
-            temperature=0.01,
-            top_p = 0.55,
-            frequency_penalty = 0,
-            presence_penalty = 0
-        )
+        async with _openai_semaphore:
+            response = await _create_with_retry(
+                model="gpt-4.1",
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": prompt
+                            },
+                            {
+                                "type": "image_url",
+                                "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
+                            }
+                        ]
+                    }
+                ],
+                response_format={"type": "json_object"},
+                max_tokens=2000,
+                temperature=0.01,
+                top_p = 0.55,
+                frequency_penalty = 0,
+                presence_penalty = 0
+            )
         
         result_text = response.choices[0].message.content
         logger.debug(f"OpenAI response: {result_text}")
         
         # Parse the JSON response
-        result = json.loads(result_text)
+        if orjson is not None:
+            result = orjson.loads(result_text)
+        else:
+            result = json.loads(result_text)
         
         # Ensure all required fields are present
         required_fields = ["food_name", "calories", "protein", "fat", "carbs", "fiber", "sugar", "sodium", "cholesterol"]
@@ -108,6 +210,8 @@ async def analyze_food_image(base64_image: str) -> dict:
             if field not in result:
                 result[field] = 0 if field != "food_name" else "Неизвестное блюдо"
         
+        if cache_key is not None:
+            _cache_put(cache_key, result)
         return result
     
     except Exception as e:
@@ -23,6 +23,28 @@ AVAILABLE_TIMEZONES = {
 # Часовой пояс по умолчанию - Москва
 DEFAULT_TIMEZONE = "МСК"  # Europe/Moscow
 
+# Готовые строки прогресс-баров: 11 вариантов заполнения (0..10) на символ,
+# чтобы не собирать строку умножением эмодзи на каждый рендер
+_BAR_WIDTH = 10
+_BAR_CACHE = {
+    char: [char * i + "⬜" * (_BAR_WIDTH - i) for i in range(_BAR_WIDTH + 1)]
+    for char in ("🟩", "🟨", "🟥", "🔵", "🟡", "🟠", "⬛")
+}
+
+# Символ бара для каждого нутриента
+_NUTRIENT_CHAR = {
+    "protein": "🔵",  # Синий для белков
+    "fat": "🟡",      # Жёлтый для жиров
+    "carbs": "🟠",    # Оранжевый для углеводов
+}
+
+# Стандартные рекомендации, если цель не установлена
+_DEFAULT_TARGETS = {
+    "protein": 75,   # 75г белка - стандартная рекомендация
+    "fat": 60,       # 60г жиров - стандартная рекомендация
+    "carbs": 250,    # 250г углеводов - стандартная рекомендация
+}
+
 class FoodEntry:
     """Food entry class for storing individual food items"""
     def __init__(self, food_name: str, calories: float, protein: float, fat: float, carbs: float, tz: Optional[tzinfo] = None):
@@ -197,7 +219,6 @@ class UserData:
     def generate_calorie_progress_bar(self, percentage: float, width: int = 10) -> str:
         """Generate a text progress bar for calorie consumption"""
         filled_chars = min(int(percentage / 100 * width), width)
-        empty_chars = width - filled_chars
         
         if percentage < 85:
             bar_char = "🟩"  # Зеленый для нормального употребления
@@ -205,8 +226,10 @@ class UserData:
             bar_char = "🟨"  # Желтый для приближения к лимиту
         else:
             bar_char = "🟥"  # Красный для превышения лимита
-            
-        return f"{bar_char * filled_chars}{'⬜' * empty_chars} {int(percentage)}%"
+        
+        if width == _BAR_WIDTH:
+            return f"{_BAR_CACHE[bar_char][filled_chars]} {int(percentage)}%"
+        return f"{bar_char * filled_chars}{'⬜' * (width - filled_chars)} {int(percentage)}%"
     
     def generate_nutrient_progress_bar(self, value: float, target: float, nutrient_type: str, width: int = 10) -> str:
         """
@@ -223,28 +246,24 @@ class UserData:
         """
         if target <= 0:
             # Если цель не установлена, используем стандартные значения
-            if nutrient_type == "protein":
-                target = 75  # 75г белка - стандартная рекомендация
-            elif nutrient_type == "fat":
-                target = 60  # 60г жиров - стандартная рекомендация
-            elif nutrient_type == "carbs":
-                target = 250  # 250г углеводов - стандартная рекомендация
+            target = _DEFAULT_TARGETS.get(nutrient_type, 0)
         
         percentage = min(100, int(value / target * 100)) if target > 0 else 0
         filled_chars = min(int(percentage / 100 * width), width)
-        empty_chars = width - filled_chars
         
         # Выбираем эмодзи в зависимости от типа нутриента
-        if nutrient_type == "protein":
-            bar_char = "🔵"  # Синий для белков
-        elif nutrient_type == "fat":
-            bar_char = "🟡"  # Жёлтый для жиров
-        elif nutrient_type == "carbs":
-            bar_char = "🟠"  # Оранжевый для углеводов
-        else:
-            bar_char = "⬛"  # Чёрный для неизвестного типа
-            
-        return f"{bar_char * filled_chars}{'⬜' * empty_chars} {int(percentage)}%"
+        bar_char = _NUTRIENT_CHAR.get(nutrient_type, "⬛")
+        
+        if width == _BAR_WIDTH:
+            return f"{_BAR_CACHE[bar_char][filled_chars]} {int(percentage)}%"
+        return f"{bar_char * filled_chars}{'⬜' * (width - filled_chars)} {int(percentage)}%"
 
 # In-memory storage for user data
 user_data_storage: Dict[int, UserData] = {}
+
+def get_user_data(user_id: int) -> UserData:
+    """Получить или создать данные пользователя одним обращением к словарю"""
+    user_data = user_data_storage.get(user_id)
+    if user_data is None:
+        user_data = user_data_storage.setdefault(user_id, UserData(user_id))
+    return user_data
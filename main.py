@@ -1,30 +1,36 @@
 
 import asyncio
+import atexit
 import logging
 import os
-import signal
+import queue
 import sys
-from bot.bot import bot_app
+from logging.handlers import QueueHandler, QueueListener
+
+from bot.bot import get_bot_app
 
 from dotenv import load_dotenv
 load_dotenv()
 
-# Configure logging
+# Configure logging. Запись в stderr уходит в фоновый поток через очередь:
+# logger.error в обработчиках не блокируется на I/O
 logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+_root_logger = logging.getLogger()
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, *_root_logger.handlers, respect_handler_level=True)
+_root_logger.handlers = [QueueHandler(_log_queue)]
+_log_listener.start()
+atexit.register(_log_listener.stop)
 
-# Handle termination signals
-def handle_exit(signum, frame):
-    logger.info("Stopping bot due to signal...")
-    sys.exit(0)
+logger = logging.getLogger(__name__)
 
-signal.signal(signal.SIGTERM, handle_exit)
-signal.signal(signal.SIGINT, handle_exit)
+# Сигналы SIGTERM/SIGINT обрабатываются внутри BotApp.main:
+# там отменяется задача поллинга и закрывается сессия бота
 
 if __name__ == "__main__":
     try:
         # Run the bot
-        asyncio.run(bot_app.main())
+        asyncio.run(get_bot_app().main())
     except KeyboardInterrupt:
         logger.info("Bot stopped by keyboard interrupt")
     except Exception as e: